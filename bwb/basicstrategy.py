@@ -9,8 +9,26 @@ from backtesting.lib import crossover
 
 try:
     from . import indicator
+    from .cache import ResultCache
+    from .timing import timer
 except:
     import indicator
+    from cache import ResultCache
+    from timing import timer
+
+# Results of Btest.run, off until result_cache.enabled is set or inside result_cache.directory() (see cache.ResultCache)
+result_cache = ResultCache(modules=(indicator,))
+
+def crossovers(series1, series2):
+    '''
+    crossover() evaluated at every bar at once, numbers are broadcast against the other series.
+    '''
+    series1, series2 = np.broadcast_arrays(np.asarray(series1, dtype=float), np.asarray(series2, dtype=float))
+    result = np.zeros(series1.shape, dtype=bool)
+    with np.errstate(invalid='ignore'):
+        result[1:] = (series1[:-1] < series2[:-1]) & (series1[1:] > series2[1:])
+    return result
+
 
 class ObjectStrategy(Strategy):
     @property
@@ -29,11 +47,30 @@ class ObjectStrategy(Strategy):
     def indicator_params(self, value):
         self.__indicator_params = value
 
+    def I(self, func, *args, **kwargs):
+        with timer.span('I', indicator=kwargs.get('name') or getattr(func, '__qualname__', repr(func))):
+            return super().I(func, *args, **kwargs)
+
 
 class Btest(Backtest):
     def __init__(self, strategy, cash = 1000, commission = 0.00495, margin = 1.0, trade_on_close = True, exclusive_orders = True):
         data = strategy.candle
-        super().__init__(data=data, strategy=strategy, cash=cash, commission=commission, margin=margin, trade_on_close=trade_on_close, exclusive_orders=exclusive_orders)
+        self._settings = {'cash':cash, 'commission':commission, 'margin':margin, 'trade_on_close':trade_on_close, 'exclusive_orders':exclusive_orders}
+        super().__init__(data=data, strategy=strategy, **self._settings)
+
+    def run(self, **kwargs):
+        self._run_kwargs = kwargs
+        with timer.span('Btest.run'):
+            if not result_cache.active(): return super().run(**kwargs)
+            key = result_cache.key(self._strategy, self._data, self._settings, kwargs)
+            if key is None: return super().run(**kwargs)
+            found, result = result_cache.get(key)
+            if found:
+                self._results = result
+                return result
+            result = super().run(**kwargs)
+            result_cache.put(key, result)
+            return result
         
     def htmlsaver(self, path, results: pd.Series = None, filename=None, plot_width=None,
              plot_equity=True, plot_return=True, plot_pl=True,
@@ -42,24 +79,27 @@ class Btest(Backtest):
              superimpose = True,
              resample=True, reverse_indicators=False,
              show_legend=True, open_browser=False):
-             backtesting._plotting.plot(
-                results=self._results,
-                df=self._data,
-                indicators=self._results._strategy._indicators,
-                filename=path,
-                plot_width=plot_width,
-                plot_equity=plot_equity,
-                plot_return=plot_return,
-                plot_pl=plot_pl,
-                plot_volume=plot_volume,
-                plot_drawdown=plot_drawdown,
-                smooth_equity=smooth_equity,
-                relative_equity=relative_equity,
-                superimpose=superimpose,
-                resample=resample,
-                reverse_indicators=reverse_indicators,
-                show_legend=show_legend,
-                open_browser=open_browser)
+             with timer.span('htmlsaver'):
+                 # Cached results have no Strategy instance to plot
+                 if '_strategy' not in self._results: super().run(**self._run_kwargs)
+                 backtesting._plotting.plot(
+                    results=self._results,
+                    df=self._data,
+                    indicators=self._results._strategy._indicators,
+                    filename=path,
+                    plot_width=plot_width,
+                    plot_equity=plot_equity,
+                    plot_return=plot_return,
+                    plot_pl=plot_pl,
+                    plot_volume=plot_volume,
+                    plot_drawdown=plot_drawdown,
+                    smooth_equity=smooth_equity,
+                    relative_equity=relative_equity,
+                    superimpose=superimpose,
+                    resample=resample,
+                    reverse_indicators=reverse_indicators,
+                    show_legend=show_legend,
+                    open_browser=open_browser)
 
 
 class SMACross(ObjectStrategy):
@@ -92,6 +132,9 @@ class SMACross(ObjectStrategy):
         elif crossover(self.long, self.short):
             self.position.close()
 
+    def signals(self):
+        return crossovers(self.short, self.long), crossovers(self.long, self.short)
+
 
 class MACDCross(ObjectStrategy):
     """
@@ -120,6 +163,9 @@ class MACDCross(ObjectStrategy):
         elif crossover(self.macdsignal, self.macd):
             self.position.close()
 
+    def signals(self):
+        return crossovers(self.macd, self.macdsignal), crossovers(self.macdsignal, self.macd)
+
 
 class BBCross(ObjectStrategy):
     """
@@ -150,6 +196,9 @@ class BBCross(ObjectStrategy):
         elif crossover(self.upper, self.data['Close']):
             self.position.close()
 
+    def signals(self):
+        return crossovers(self.data['Close'], self.lower), crossovers(self.upper, self.data['Close'])
+
 
 class DMICross(ObjectStrategy):
     """
@@ -176,6 +225,9 @@ class DMICross(ObjectStrategy):
         elif crossover(self.di_m, self.di_p):
             self.position.close()
 
+    def signals(self):
+        return crossovers(self.di_p, self.di_m), crossovers(self.di_m, self.di_p)
+
 
 class SARCross(ObjectStrategy):
     """
@@ -203,6 +255,9 @@ class SARCross(ObjectStrategy):
         elif crossover(self.sar, self.data['Close']):
             self.position.close()
 
+    def signals(self):
+        return crossovers(self.data['Close'], self.sar), crossovers(self.sar, self.data['Close'])
+
 
 class RSICross(ObjectStrategy):
     """
@@ -230,6 +285,9 @@ class RSICross(ObjectStrategy):
         elif crossover(self.rsi, self.indicator_params['sell_ratio']):
             self.position.close()
 
+    def signals(self):
+        return crossovers(self.indicator_params['buy_ratio'], self.rsi), crossovers(self.rsi, self.indicator_params['sell_ratio'])
+
 
 class StochasticsCross(ObjectStrategy):
     """
@@ -258,6 +316,10 @@ class StochasticsCross(ObjectStrategy):
         elif (crossover(self.slow_per_d, self.indicator_params['sell_ratio']) and (crossover(self.slow_per_d, self.slow_per_k))):
             self.position.close()
 
+    def signals(self):
+        return (crossovers(self.indicator_params['buy_ratio'], self.slow_per_d) & crossovers(self.slow_per_k, self.slow_per_d),
+                crossovers(self.slow_per_d, self.indicator_params['sell_ratio']) & crossovers(self.slow_per_d, self.slow_per_k))
+
 
 class PsychologicalCross(ObjectStrategy):
     """
@@ -285,6 +347,10 @@ class PsychologicalCross(ObjectStrategy):
         elif self.psyco > self.indicator_params['sell_ratio']:
             self.position.close()
 
+    def signals(self):
+        with np.errstate(invalid='ignore'):
+            return self.indicator_params['buy_ratio'] > np.asarray(self.psyco), np.asarray(self.psyco) > self.indicator_params['sell_ratio']
+
 
 class RCICross(ObjectStrategy):
     """
@@ -313,6 +379,9 @@ class RCICross(ObjectStrategy):
         elif crossover(self.rci, self.indicator_params['sell_ratio']):
             self.position.close()
 
+    def signals(self):
+        return crossovers(self.indicator_params['buy_ratio'], self.rci), crossovers(self.rci, self.indicator_params['sell_ratio'])
+
 
 class MAERCross(ObjectStrategy):
     """
@@ -338,4 +407,7 @@ class MAERCross(ObjectStrategy):
         if crossover(self.indicator_params['buy_ratio'], self.maer):
             self.buy()
         elif crossover(self.maer, self.indicator_params['sell_ratio']):
-            self.position.close()
\ No newline at end of file
+            self.position.close()
+
+    def signals(self):
+        return crossovers(self.indicator_params['buy_ratio'], self.maer), crossovers(self.maer, self.indicator_params['sell_ratio'])
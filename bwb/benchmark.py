@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+import argparse, datetime, inspect, json, platform, shutil, subprocess, tempfile, time, tracemalloc, warnings
+import pandas as pd
+import numpy as np
+
+try:
+    from . import basicstrategy as bst
+    from . import db
+    from . import indicator
+    from . import optimizer
+    from .source import FrameSource
+except:
+    import basicstrategy as bst
+    import db
+    import indicator
+    import optimizer
+    from source import FrameSource
+
+INDICATOR_SIZES = (1_000, 10_000, 100_000, 1_000_000)
+STRATEGY_SIZE = 1_000
+LOCALDB_SIZES = (1_000, 10_000, 50_000)
+# Parameters of indicators without a default
+INDICATOR_PARAMS = {'rsi':{'span':14}}
+
+def synthetic_candle(bars, freq='D', start='1900-01-01', seed=0):
+    '''
+    Random walk OHLCV candle of bars rows, generated offline and reproducible by seed.
+    '''
+    rng = np.random.default_rng(seed)
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.01, bars)))
+    open = np.r_[close[0], close[:-1]] * np.exp(rng.normal(0, 0.002, bars))
+    high = np.maximum(open, close) * (1 + rng.random(bars) * 0.01)
+    low = np.minimum(open, close) * (1 - rng.random(bars) * 0.01)
+    volume = rng.integers(1_000, 1_000_000, bars).astype(float)
+    index = pd.date_range(start, periods=bars, freq=freq, name='Date')
+    return pd.DataFrame({'Open':open, 'High':high, 'Low':low, 'Close':close, 'Volume':volume}, index=index)
+
+def measure(func, *args, repeat=3, **kwargs):
+    '''
+    Best wall time of repeat calls, and the peak of memory allocated by one more call under tracemalloc.
+    '''
+    seconds = []
+    for _ in range(repeat):
+        t = time.perf_counter()
+        func(*args, **kwargs)
+        seconds.append(time.perf_counter() - t)
+    tracemalloc.start()
+    try:
+        func(*args, **kwargs)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {'seconds':min(seconds), 'peak_bytes':peak}
+
+def indicators():
+    # Public functions of bwb.indicator taking a candle as first argument
+    return {name:func for name, func in vars(indicator).items()
+            if inspect.isfunction(func) and not name.startswith('_') and func.__module__ == indicator.__name__
+            and next(iter(inspect.signature(func).parameters), None) == 'data'}
+
+def strategies():
+    return {name:cls for name, cls in vars(bst).items()
+            if inspect.isclass(cls) and issubclass(cls, bst.ObjectStrategy) and 'base_indicator_params' in vars(cls)}
+
+def bench_indicators(sizes=INDICATOR_SIZES, repeat=3):
+    results = []
+    enabled, indicator.cache.enabled = indicator.cache.enabled, False
+    try:
+        for bars in sizes:
+            candle = synthetic_candle(bars, freq='min', start='2000-01-01')
+            for name, func in indicators().items():
+                params = INDICATOR_PARAMS.get(name, {})
+                results.append(dict(group='indicator', name=name, bars=bars, params=params, **measure(func, candle, repeat=repeat, **params)))
+    finally:
+        indicator.cache.enabled = enabled
+    return results
+
+def bench_strategies(bars=STRATEGY_SIZE, repeat=1, limit=None):
+    '''
+    Btest.run() of every strategy over its base_indicator_params() grid (the first limit combinations).
+    '''
+    candle = synthetic_candle(bars)
+    results = []
+    for name, strategy in strategies().items():
+        combos = optimizer.grid(strategy.base_indicator_params())[:limit]
+
+        def run():
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore')
+                for params in combos:
+                    optimizer.backtest(strategy, candle, params)
+
+        # Indicators are cached by content, keep every run a cold one
+        enabled, indicator.cache.enabled = indicator.cache.enabled, False
+        try:
+            results.append(dict(group='strategy', name=name, bars=bars, params={'combinations':len(combos)}, **measure(run, repeat=repeat)))
+        finally:
+            indicator.cache.enabled = enabled
+    return results
+
+def bench_localdb(sizes=LOCALDB_SIZES, formats=None, repeat=3):
+    '''
+    LocalDB save (loader on an empty LocalDB) and load (loader on a stored candle) per save_format.
+    '''
+    results = []
+    for bars in sizes:
+        candle = synthetic_candle(bars)
+        source = FrameSource({'BENCH':candle})
+        start = str(candle.index[0].date() - datetime.timedelta(days=1))
+        end = str(candle.index[-1].date() + datetime.timedelta(days=1))
+        for save_format in formats or list(db.CANDLE_FORMATS):
+            root = tempfile.mkdtemp() + '/'
+            try:
+                localdb = db.LocalDB(root, save_format, source=source)
+
+                def save():
+                    shutil.rmtree(root + 'BENCH', ignore_errors=True)
+                    localdb.loader('BENCH', start, end)
+
+                def load():
+                    localdb.loader('BENCH', start, end)
+
+                for name, func in (('save', save), ('load', load)):
+                    results.append(dict(group='localdb', name=save_format + '.' + name, bars=bars, params={}, **measure(func, repeat=repeat)))
+            except ImportError as e:
+                # parquet and feather need pyarrow
+                results.append(dict(group='localdb', name=save_format, bars=bars, params={}, error=str(e)))
+            finally:
+                shutil.rmtree(root, ignore_errors=True)
+    return results
+
+def commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run(groups=('indicator', 'strategy', 'localdb'), **kwargs):
+    '''
+    Run the benchmark groups and return a JSON-serializable report, kwargs go to bench_<group>.
+    '''
+    benches = {'indicator':bench_indicators, 'strategy':bench_strategies, 'localdb':bench_localdb}
+    results = []
+    for group in groups:
+        results += benches[group](**kwargs.get(group, {}))
+    return {
+        'meta':{
+            'commit':commit(),
+            'time':datetime.datetime.now().isoformat(timespec='seconds'),
+            'python':platform.python_version(),
+            'numpy':np.__version__,
+            'pandas':pd.__version__,
+            'machine':platform.machine(),
+            },
+        'results':results,
+        }
+
+def save(report, path):
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=1)
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)
+
+def compare(old, new):
+    '''
+    Results of two reports side by side, ratio > 1 means new is slower / uses more memory.
+    '''
+    def frame(report):
+        df = pd.DataFrame(report['results'])
+        return df[df['seconds'].notna()].set_index(['group', 'name', 'bars'])[['seconds', 'peak_bytes']] if 'seconds' in df else df
+    df = frame(old).join(frame(new), lsuffix='_old', rsuffix='_new', how='inner')
+    df['time_ratio'] = df['seconds_new'] / df['seconds_old']
+    df['memory_ratio'] = df['peak_bytes_new'] / df['peak_bytes_old']
+    return df
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Benchmark indicators, strategies and LocalDB I/O on synthetic candles.')
+    parser.add_argument('-o', '--output', default='benchmark.json', help='JSON report to write')
+    parser.add_argument('-g', '--groups', nargs='+', default=['indicator', 'strategy', 'localdb'], choices=['indicator', 'strategy', 'localdb'])
+    parser.add_argument('--sizes', nargs='+', type=int, help='bars of the indicator benchmark')
+    parser.add_argument('--limit', type=int, help='combinations per strategy grid')
+    parser.add_argument('--compare', help='earlier JSON report to compare with')
+    args = parser.parse_args(args)
+    kwargs = {'strategy':{'limit':args.limit}}
+    if args.sizes: kwargs['indicator'] = {'sizes':args.sizes}
+    report = run(args.groups, **kwargs)
+    save(report, args.output)
+    df = pd.DataFrame(report['results'])
+    print(df.drop(columns='params').to_string(index=False))
+    if args.compare:
+        print(compare(load(args.compare), report).to_string())
+
+if __name__ == '__main__':
+    main()
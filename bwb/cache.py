@@ -0,0 +1,408 @@
+# -*- coding: utf-8 -*-
+import contextlib, functools, hashlib, inspect, os, threading
+from collections import OrderedDict
+import pandas as pd
+import numpy as np
+
+try:
+    from .lazy import lazy
+except:
+    from lazy import lazy
+
+backtesting = lazy('backtesting')
+
+def digest_array(h, v):
+    v = np.asarray(v)
+    h.update(str(v.dtype).encode())
+    if v.dtype.kind in 'biufcmM':
+        h.update(np.ascontiguousarray(v).tobytes())
+    else:
+        h.update(pd.util.hash_pandas_object(pd.Index(v), index=False).values.tobytes())
+
+def digest(data, columns):
+    '''
+    Digest of data[columns] and data.index, for DataFrame and backtesting's _Data alike.
+    '''
+    h = hashlib.blake2b(type(data).__name__.encode(), digest_size=16)
+    for column in columns:
+        h.update(column.encode())
+        digest_array(h, data[column])
+    digest_array(h, data.index)
+    return h.hexdigest()
+
+def frame_digest(df):
+    '''
+    Digest of a DataFrame's columns, index and values, in one pass over the values when they are all numbers.
+    '''
+    if not all(dtype.kind in 'biuf' for dtype in df.dtypes): return digest(df, list(df.columns))
+    h = hashlib.blake2b(repr([(str(c), str(t)) for c, t in df.dtypes.items()]).encode(), digest_size=16)
+    h.update(np.ascontiguousarray(df.to_numpy(dtype=float)).tobytes())
+    digest_array(h, df.index)
+    return h.hexdigest()
+
+def locate(data, columns, parent):
+    '''
+    Position of data in parent when data is a shorter contiguous slice of it (same index and data[columns]), else None.
+    '''
+    index = pd.Index(data.index)
+    n = len(index)
+    if not 0 < n < len(parent) or index[0] not in parent.index: return None
+    start = parent.index.get_loc(index[0])
+    if not isinstance(start, int) or not parent.index[start:start+n].equals(index): return None
+    for column in columns:
+        if not np.array_equal(np.asarray(data[column]), np.asarray(parent[column])[start:start+n], equal_nan=True): return None
+    return start
+
+def cut(v, start, stop):
+    if isinstance(v, tuple): return tuple(cut(x, start, stop) for x in v)
+    if isinstance(v, (pd.Series, pd.DataFrame)): return v.iloc[start:stop]
+    return np.asarray(v)[..., start:stop]
+
+def normalize(v):
+    if isinstance(v, np.generic): return v.item()
+    if isinstance(v, np.ndarray): return ('array', v.tolist())
+    if isinstance(v, (list, tuple)): return tuple(map(normalize, v))
+    if isinstance(v, dict): return tuple(sorted((k, normalize(x)) for k, x in v.items()))
+    return v
+
+def copy(v):
+    # Callers get their own objects, the cached ones are never handed out
+    if isinstance(v, tuple): return tuple(map(copy, v))
+    return v.copy() if hasattr(v, 'copy') else v
+
+def sizeof(v):
+    if isinstance(v, tuple): return sum(map(sizeof, v))
+    if isinstance(v, (pd.Series, pd.DataFrame)): return int(np.sum(v.memory_usage(index=True)))
+    return getattr(v, 'nbytes', 0)
+
+
+class IndicatorCache:
+    '''
+    LRU cache of indicator results keyed by function, the source of its module, parameters and a digest of the candle.
+    max_bytes bounds the memory tier, path (optional) is a directory of pickled results, directory() sets it
+    for the calls of one thread only, e.g. LocalDB's backtests of an issue.
+    Indicators of a slice of a candle registered with sliced() are computed once on the whole candle and cut,
+    so they are warmed up on the history before the slice.
+    '''
+    def __init__(self, max_bytes=256 << 20, path=None):
+        self.max_bytes = max_bytes
+        self.path = path
+        self.enabled = True
+        self.nbytes = 0
+        self.hits, self.disk_hits, self.misses = 0, 0, 0
+        self.parents = []
+        self.__store = OrderedDict()
+        self.__lock = threading.Lock()
+        self.__local = threading.local()
+
+    def info(self):
+        return {
+            'hits':self.hits,
+            'disk_hits':self.disk_hits,
+            'misses':self.misses,
+            'entries':len(self.__store),
+            'nbytes':self.nbytes,
+            }
+
+    @contextlib.contextmanager
+    def directory(self, path):
+        # path instead of self.path for the calls of this thread
+        previous = getattr(self.__local, 'path', None)
+        self.__local.path = path
+        try:
+            yield self
+        finally:
+            self.__local.path = previous
+
+    def disk_dir(self):
+        return getattr(self.__local, 'path', None) or self.path
+
+    def clear(self):
+        with self.__lock:
+            self.__store.clear()
+            self.nbytes = 0
+            self.hits, self.disk_hits, self.misses = 0, 0, 0
+
+    def key(self, name, data, columns, params):
+        h = hashlib.blake2b(name.encode(), digest_size=16)
+        h.update(digest(data, columns).encode())
+        h.update(repr(normalize(params)).encode())
+        return h.hexdigest()
+
+    def get(self, key, disk=True):
+        with self.__lock:
+            if key in self.__store:
+                self.__store.move_to_end(key)
+                self.hits += 1
+                return True, self.__store[key][0]
+        path = self.disk_dir() if disk else None
+        if path and os.path.exists(os.path.join(path, key + '.pkl')):
+            value = pd.read_pickle(os.path.join(path, key + '.pkl'))
+            with self.__lock:
+                self.disk_hits += 1
+            self.put(key, value, disk=False)
+            return True, value
+        with self.__lock:
+            self.misses += 1
+        return False, None
+
+    def put(self, key, value, disk=True):
+        size = sizeof(value)
+        with self.__lock:
+            if key in self.__store:
+                self.nbytes -= self.__store.pop(key)[1]
+            if size <= self.max_bytes:
+                self.__store[key] = (value, size)
+                self.nbytes += size
+            while self.nbytes > self.max_bytes:
+                self.nbytes -= self.__store.popitem(last=False)[1][1]
+        path = self.disk_dir() if disk else None
+        if path:
+            os.makedirs(path, exist_ok=True)
+            tmp = os.path.join(path, key + '.%d.%d.tmp' % (os.getpid(), threading.get_ident()))
+            pd.to_pickle(value, tmp)
+            os.replace(tmp, os.path.join(path, key + '.pkl'))
+
+    @contextlib.contextmanager
+    def sliced(self, candle):
+        self.parents.append(candle)
+        try:
+            yield self
+        finally:
+            self.parents.remove(candle)
+
+    def memoize(self, *columns):
+        '''
+        Decorator for indicator(data, *params) reading data[columns].
+        '''
+        def decorator(func):
+            signature = inspect.signature(func)
+            # Pickles of an older version of the indicator (or of what it calls in its module) are not read,
+            # without source the results stay in memory
+            code = source_digest(func)
+            name = func.__qualname__ + ':' + (code or '')
+
+            @functools.wraps(func)
+            def wrapper(data, *args, **kwargs):
+                if not self.enabled:
+                    return func(data, *args, **kwargs)
+                for parent in self.parents:
+                    start = locate(data, columns, parent)
+                    if start is not None:
+                        return cut(wrapper(parent, *args, **kwargs), start, start + len(data.index))
+                bound = signature.bind(data, *args, **kwargs)
+                bound.apply_defaults()
+                params = tuple(bound.arguments.items())[1:]
+                key = self.key(name, data, columns, params)
+                found, value = self.get(key, disk=code is not None)
+                if not found:
+                    value = func(data, *args, **kwargs)
+                    self.put(key, value, disk=code is not None)
+                return copy(value)
+            return wrapper
+        return decorator
+
+
+def plain(v):
+    # Values whose repr (see normalize) is the same in every process: numbers, strings and containers of them
+    if v is None or isinstance(v, (bool, int, float, complex, str, bytes, np.generic)): return True
+    if isinstance(v, np.ndarray): return v.dtype.kind in 'biufcUSmM'
+    if isinstance(v, (list, tuple)): return all(map(plain, v))
+    if isinstance(v, dict): return all(plain(k) and plain(x) for k, x in v.items())
+    return False
+
+def strategy_digest(strategy):
+    '''
+    Digest of the code of strategy and its bases up to backtesting's Strategy (their modules' source where
+    it can be read, else the class source) and of their plain class attributes, e.g. candle aside, indicator_params.
+    None when the source of one of them cannot be read, e.g. a class defined in an interactive session.
+    '''
+    h = hashlib.blake2b(digest_size=16)
+    for cls in strategy.__mro__:
+        if cls.__module__.split('.')[0] in ('backtesting', 'builtins'): continue
+        code = code_digest(cls)
+        if code is None: return None
+        h.update(code.encode())
+        for name, v in sorted(vars(cls).items()):
+            # _abc_impl and other objects have a memory address in their repr
+            if name == 'candle' or name.startswith('__') or not plain(v): continue
+            h.update(name.encode())
+            h.update(repr(normalize(v)).encode())
+    return h.hexdigest()
+
+def source_digest(obj):
+    # Digest of the source of obj's module where it can be read, else of obj's own, None without source
+    for source in (inspect.getmodule(obj), obj):
+        try:
+            return hashlib.blake2b(inspect.getsource(source).encode(), digest_size=16).hexdigest()
+        except (OSError, TypeError):
+            pass
+    return None
+
+@functools.lru_cache(maxsize=256)
+def file_digest(path, mtime, size):
+    # Hashed again when the file changes, mtime and size are the key
+    with open(path, 'rb') as f:
+        return hashlib.blake2b(f.read(), digest_size=16).hexdigest()
+
+def module_digest(module):
+    path = getattr(module, '__file__', None)
+    try:
+        stat = os.stat(path)
+    except (OSError, TypeError):
+        return None
+    return file_digest(path, stat.st_mtime_ns, stat.st_size)
+
+@functools.lru_cache(maxsize=256)
+def class_digest(cls):
+    # Classes without a module file, hashed once per class object
+    return source_digest(cls)
+
+def code_digest(obj):
+    '''
+    Digest of the file of a module or of a class' module, so an edited and importlib.reload()ed module gets a new one.
+    Classes made by type(), e.g. optimizer.bind, get their module's. None without source.
+    '''
+    if inspect.ismodule(obj): return module_digest(obj)
+    module = inspect.getmodule(obj)
+    code = module_digest(module) if module is not None else None
+    return code if code is not None else class_digest(obj)
+
+
+class ResultCache:
+    '''
+    Backtest results (stats, equity curve and trades) keyed by a digest of the candle, the code and attributes
+    of the strategy (see strategy_digest), the source of modules (e.g. indicator), the broker settings and the run arguments,
+    see basicstrategy.Btest.run. Strategies without readable source have no key and are not cached.
+    The last max_entries results are kept in memory, every result in path (optional) as a pickle,
+    the least recently used ones are removed beyond max_bytes.
+    Off until enabled is set, or for the calls of one thread inside directory(), e.g. LocalDB(result_cache=True)'s backtests.
+    '''
+    def __init__(self, path=None, max_bytes=1 << 30, max_entries=256, modules=()):
+        self.path = path
+        self.modules = modules
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.enabled = False
+        self.hits, self.disk_hits, self.misses = 0, 0, 0
+        # Size of each path, scanned on its first write
+        self.disk_bytes = {}
+        self.__store = OrderedDict()
+        self.__lock = threading.Lock()
+        self.__local = threading.local()
+
+    def info(self):
+        return {
+            'hits':self.hits,
+            'disk_hits':self.disk_hits,
+            'misses':self.misses,
+            'entries':len(self.__store),
+            'disk_bytes':self.disk_bytes.get(self.disk_dir()),
+            }
+
+    @contextlib.contextmanager
+    def directory(self, path):
+        # Enabled with path instead of self.path for the calls of this thread
+        previous = getattr(self.__local, 'path', None)
+        self.__local.path = path
+        try:
+            yield self
+        finally:
+            self.__local.path = previous
+
+    def disk_dir(self):
+        return getattr(self.__local, 'path', None) or self.path
+
+    def active(self):
+        return self.enabled or getattr(self.__local, 'path', None) is not None
+
+    def clear(self):
+        with self.__lock:
+            self.__store.clear()
+            self.hits, self.disk_hits, self.misses = 0, 0, 0
+
+    def key(self, strategy, data, broker, kwargs):
+        codes = [strategy_digest(strategy)] + [code_digest(module) for module in self.modules]
+        if None in codes: return None
+        h = hashlib.blake2b(backtesting.__version__.encode(), digest_size=16)
+        for code in codes:
+            h.update(code.encode())
+        h.update(frame_digest(data).encode())
+        h.update(repr(sorted((k, normalize(v)) for k, v in {**broker, **kwargs}.items())).encode())
+        return h.hexdigest()
+
+    def disk_path(self, key, path=None):
+        return os.path.join(path or self.disk_dir(), key + '.pkl')
+
+    @staticmethod
+    def copy(result):
+        result = result.copy()
+        for name in ('_equity_curve', '_trades'):
+            if name in result: result[name] = result[name].copy()
+        return result
+
+    def get(self, key):
+        with self.__lock:
+            if key in self.__store:
+                self.__store.move_to_end(key)
+                self.hits += 1
+                return True, self.copy(self.__store[key])
+        path = self.disk_dir()
+        value = None
+        if path and os.path.exists(self.disk_path(key, path)):
+            try:
+                value = pd.read_pickle(self.disk_path(key, path))
+                # Recently used for evict()
+                os.utime(self.disk_path(key, path))
+            except (OSError, EOFError):
+                # Evicted meanwhile by another process
+                value = None
+        with self.__lock:
+            if value is None:
+                self.misses += 1
+                return False, None
+            self.disk_hits += 1
+        self.put(key, value, disk=False)
+        return True, self.copy(value)
+
+    def put(self, key, value, disk=True):
+        # The Strategy instance holds the whole backtest, results are plotted by running it again
+        value = self.copy(value.drop('_strategy', errors='ignore'))
+        with self.__lock:
+            self.__store[key] = value
+            self.__store.move_to_end(key)
+            while len(self.__store) > self.max_entries:
+                self.__store.popitem(last=False)
+        path = self.disk_dir()
+        if disk and path:
+            os.makedirs(path, exist_ok=True)
+            tmp = self.disk_path(key, path) + '.%d.%d.tmp' % (os.getpid(), threading.get_ident())
+            pd.to_pickle(value, tmp)
+            os.replace(tmp, self.disk_path(key, path))
+            size = os.path.getsize(self.disk_path(key, path))
+            with self.__lock:
+                total = self.disk_bytes.get(path)
+                if total is not None: total = self.disk_bytes[path] = total + size
+            if total is None or total > self.max_bytes: self.evict(path)
+
+    def evict(self, path=None):
+        # Least recently used pickles of path (default: disk_dir()) beyond max_bytes
+        path = path or self.disk_dir()
+        files = []
+        for entry in os.scandir(path):
+            if entry.name.endswith('.pkl'):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes: break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+        with self.__lock:
+            self.disk_bytes[path] = total
@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+'''
+bwb command line, e.g.
+    bwb run job.yaml
+    bwb run --issues AAPL MSFT --strategy RCICross --grid '{"span": [9, 14]}' --start 2020-01-01 --end 2021-01-01
+    bwb top results.db RCICross --metric "Sharpe Ratio"
+    bwb submit job.yaml --queue /shared/queue.db    (then on each host) bwb work /shared/queue.db --localdb /shared/LocalDB/ --processes 8
+    bwb collect /shared/queue.db --store results.db
+    bwb bench --groups indicator
+Modules are imported by the command that needs them, so starting the command (and its pool workers) stays fast.
+'''
+import argparse, json, os, sys
+
+# Keys of a job file (JSON or YAML), options of the same name override them
+JOB = {
+    'issues':[],
+    'strategies':[],
+    'grid':None,
+    'start':None,
+    'end':None,
+    'store':'results.db',
+    'localdb':None,
+    'save_format':None,
+    'source':None,
+    'processes':None,
+    'chunksize':1,
+    'metric':'Equity Final [$]',
+    'minimize':False,
+    'broker':{},
+    }
+
+def read_job(path):
+    with open(path) as f:
+        if os.path.splitext(path)[1] in ('.yaml', '.yml'):
+            import yaml
+            job = yaml.safe_load(f)
+        else:
+            job = json.load(f)
+    unknown = set(job) - set(JOB)
+    if unknown: raise ValueError('unknown keys in %s: %s' % (path, ', '.join(sorted(unknown))))
+    return job
+
+def get_strategy(name):
+    '''
+    Strategy class by name of bwb.basicstrategy or bwb.customstrategy, or as module:Class.
+    '''
+    import importlib
+    if ':' in name:
+        module, name = name.split(':')
+        return getattr(importlib.import_module(module), name)
+    for module in ('bwb.basicstrategy', 'bwb.customstrategy'):
+        module = importlib.import_module(module)
+        if hasattr(module, name): return getattr(module, name)
+    raise ValueError('unknown strategy %r' % name)
+
+def get_grids(grid, strategies):
+    # One grid for every strategy, or {strategy name: grid}; None is base_indicator_params()
+    if not grid: return {}
+    if set(grid) <= {s.__name__ for s in strategies}: return {s:grid[s.__name__] for s in strategies if s.__name__ in grid}
+    return {s:grid for s in strategies}
+
+def get_job(args):
+    job = dict(JOB)
+    if args.job: job.update(read_job(args.job))
+    for key in JOB:
+        value = getattr(args, key, None)
+        if value not in (None, False): job[key] = value
+    if not job['issues'] or not job['strategies'] or not job['start'] or not job['end']:
+        raise ValueError('a job needs issues, strategies, start and end')
+    return job
+
+def localdb_kwargs(job):
+    from .source import get_source
+    kwargs = {k:job[k] for k in ('save_format', 'source') if job.get(k)}
+    # A source with arguments, e.g. {"name": "file", "root": "csv/"}
+    if isinstance(kwargs.get('source'), dict):
+        source = dict(kwargs['source'])
+        kwargs['source'] = get_source(source.pop('name'), **source)
+    return kwargs
+
+def get_localdb(job):
+    from . import db
+    kwargs = localdb_kwargs(job)
+    return db.LocalDB(job['localdb'], **kwargs) if job['localdb'] else db.LocalDB(**kwargs)
+
+def run(args):
+    job = get_job(args)
+    from . import optimizer
+    from .store import ResultStore
+    localdb = get_localdb(job)
+    strategies = [get_strategy(name) for name in job['strategies']]
+    with ResultStore(job['store']) as store:
+        results = optimizer.batch(localdb, job['issues'], strategies, job['start'], job['end'], store,
+            get_grids(job['grid'], strategies), job['metric'], not job['minimize'], job['processes'], job['chunksize'], **job['broker'])
+    import pandas as pd
+    rows = []
+    for (issue, name), df in results.items():
+        if not len(df): continue
+        # optimize() puts the params before the stats
+        params = df.columns[:df.columns.get_loc('Start')]
+        rows.append({'issue':issue, 'strategy':name, 'params':df.iloc[0][params].to_dict(), job['metric']:df.iloc[0][job['metric']]})
+    print(pd.DataFrame(rows).to_string(index=False))
+
+def top(args):
+    from .store import ResultStore
+    with ResultStore(args.store) as store:
+        df = store.top(args.strategy, args.metric, args.n, not args.minimize, args.issues, args.agg)
+    print(df.to_string(index=False))
+
+def submit(args):
+    job = get_job(args)
+    from .workqueue import WorkQueue
+    # Workers find the candles in localdb instead of all fetching them
+    localdb = get_localdb(job)
+    for issue in job['issues']:
+        localdb.loader(issue, job['start'], job['end'])
+    strategies = [get_strategy(name) for name in job['strategies']]
+    with WorkQueue(args.queue) as queue:
+        added = queue.submit(job['issues'], strategies, job['start'], job['end'], get_grids(job['grid'], strategies), job['broker'])
+        print('%d tasks added' % added, queue.status())
+
+def work(args):
+    from .workqueue import work
+    job = {'save_format':args.save_format, 'source':json.loads(args.source) if args.source and args.source.startswith('{') else args.source}
+    work(args.queue, args.localdb, args.processes, args.batch, args.lease, args.poll, **localdb_kwargs(job))
+
+def status(args):
+    from .workqueue import WorkQueue
+    with WorkQueue(args.queue) as queue:
+        print(queue.status())
+
+def collect(args):
+    from .store import ResultStore
+    from .workqueue import WorkQueue
+    with WorkQueue(args.queue) as queue, ResultStore(args.store) as store:
+        print('%d runs stored' % queue.collect(store))
+
+def bench(args):
+    from . import benchmark
+    benchmark.main(args.rest)
+
+def job_arguments(p):
+    # Options of a job, see JOB
+    p.add_argument('job', nargs='?', help='job file (.json, .yaml) of the keys below')
+    p.add_argument('--issues', nargs='+')
+    p.add_argument('--strategies', '--strategy', nargs='+', help='names of bwb.basicstrategy / bwb.customstrategy or module:Class')
+    p.add_argument('--grid', type=json.loads, help='JSON {param: [values]}, default base_indicator_params()')
+    p.add_argument('--start')
+    p.add_argument('--end')
+    p.add_argument('--store', help='SQLite result store, default results.db')
+    p.add_argument('--localdb', help='LocalDB directory, default ./LocalDB/')
+    p.add_argument('--save-format', dest='save_format')
+    p.add_argument('--source', help='candle source of LocalDB, e.g. yfinance (a job file may give {"name": ..., **arguments})')
+    p.add_argument('--processes', type=int)
+    p.add_argument('--chunksize', type=int)
+    p.add_argument('--metric')
+    p.add_argument('--minimize', action='store_true')
+    p.add_argument('--broker', type=json.loads, help='JSON Btest arguments, e.g. {"cash": 10000}')
+
+def parser():
+    parser = argparse.ArgumentParser(prog='bwb', description='Backtest grids of strategies over issues of a LocalDB.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    p = commands.add_parser('run', help='optimize strategies on issues, journaled in a result store (resumable)')
+    job_arguments(p)
+    p.set_defaults(func=run)
+    p = commands.add_parser('submit', help='queue the tasks of a job (as run) for workers')
+    job_arguments(p)
+    p.add_argument('--queue', required=True, help='SQLite work queue, e.g. on a shared file system')
+    p.set_defaults(func=submit)
+    p = commands.add_parser('work', help='backtest tasks of a work queue until none is left')
+    p.add_argument('queue')
+    p.add_argument('--localdb', help='LocalDB directory, default ./LocalDB/')
+    p.add_argument('--save-format', dest='save_format')
+    p.add_argument('--source', help='candle source of LocalDB, a name or JSON {"name": ..., **arguments}')
+    p.add_argument('--processes', type=int, default=1, help='workers on this host')
+    p.add_argument('--batch', type=int, default=8, help='tasks leased at a time')
+    p.add_argument('--lease', type=float, default=600, help='seconds without progress before the tasks of a dead worker are leased again')
+    p.add_argument('--poll', type=float, default=5, help='seconds between leases while others hold the rest')
+    p.set_defaults(func=work)
+    p = commands.add_parser('status', help='tasks of a work queue by status')
+    p.add_argument('queue')
+    p.set_defaults(func=status)
+    p = commands.add_parser('collect', help='move the results of a work queue into a result store')
+    p.add_argument('queue')
+    p.add_argument('--store', default='results.db')
+    p.set_defaults(func=collect)
+    p = commands.add_parser('top', help='best params of a strategy in a result store')
+    p.add_argument('store')
+    p.add_argument('strategy')
+    p.add_argument('--metric', default='Sharpe Ratio')
+    p.add_argument('-n', type=int, default=20)
+    p.add_argument('--minimize', action='store_true')
+    p.add_argument('--issues', nargs='+')
+    p.add_argument('--agg', default='avg', choices=['avg', 'min', 'max', 'sum'])
+    p.set_defaults(func=top)
+    # Options are benchmark.main's
+    p = commands.add_parser('bench', help='benchmarks, see python -m bwb.benchmark --help', add_help=False)
+    p.set_defaults(func=bench)
+    return parser
+
+def main(argv=None):
+    p = parser()
+    args, rest = p.parse_known_args(argv)
+    if args.command == 'bench': args.rest = rest
+    elif rest: p.error('unrecognized arguments: ' + ' '.join(rest))
+    try:
+        args.func(args)
+    except (ValueError, FileNotFoundError) as e:
+        sys.exit('bwb %s: %s' % (args.command, e))
+
+if __name__ == '__main__':
+    main()
@@ -1,17 +1,29 @@
 # -*- coding: utf-8 -*-
 import pandas as pd
-import pandas_datareader.data as web
-import datetime, os
+import contextlib, copy, datetime, json, os, threading
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor, wait
 from datetime import datetime as dt
 from datetime import timedelta as td
-import yfinance as yf
 from abc import ABCMeta, abstractmethod
 
 try:
-    from . import basicstrategy as bst
+    from . import indicator
+    from . import timeframe as tf
+    from .lazy import lazy
+    from .source import get_source
+    from .timing import timer
 except:
-    import basicstrategy as bst
+    import indicator
+    import timeframe as tf
+    from lazy import lazy
+    from source import get_source
+    from timing import timer
 
+# backtesting is loaded by the first backtest, not by loading candles
+bst = lazy('basicstrategy', __package__)
+
+# Default data source, a name registered in source.SOURCES
 GET_CANDDLE = 'yfinance'
 
 def str_to_date(t):
@@ -23,6 +35,117 @@ def datetime_to_date(t):
 def get_today():
     return datetime.date.today()
 
+def get_format(path):
+    return os.path.splitext(path.rstrip('/'))[1][1:]
+
+def read_csv(path):
+    df = pd.read_csv(path, index_col=0)
+    df.index = pd.to_datetime(df.index, format='ISO8601')
+    return df
+
+def write_csv(df, path):
+    df.to_csv(path)
+
+def append_csv(df, path):
+    df.to_csv(path, mode='a', header=False)
+
+def read_parquet(path):
+    return pd.read_parquet(path)
+
+def write_parquet(df, path):
+    df.to_parquet(path)
+
+def read_feather(path):
+    df = pd.read_feather(path)
+    return df.set_index(df.columns[0])
+
+def write_feather(df, path):
+    df.reset_index().to_feather(path)
+
+def read_npy(path):
+    '''
+    candle.npy/ holds index.npy (int64 ns), values.npy (float64, one column per field) and columns.json.
+    values.npy is memory-mapped copy-on-write, so the OHLCV is paged in on access.
+    '''
+    with open(os.path.join(path, 'columns.json')) as f:
+        meta = json.load(f)
+    index = pd.DatetimeIndex(np.load(os.path.join(path, 'index.npy')).view('datetime64[ns]'), name=meta['index'])
+    if meta['tz']: index = index.tz_localize('UTC').tz_convert(meta['tz'])
+    values = np.load(os.path.join(path, 'values.npy'), mmap_mode='c')
+    return pd.DataFrame(values, index=index, columns=meta['columns'], copy=False)
+
+def write_npy(df, path):
+    os.makedirs(path, exist_ok=True)
+    index = pd.DatetimeIndex(df.index)
+    meta = {'index':index.name, 'tz':str(index.tz) if index.tz else None, 'columns':list(df.columns)}
+    if index.tz: index = index.tz_convert('UTC').tz_localize(None)
+    # Replace instead of overwriting in place, a reader may still have values.npy mapped
+    for name, v in (('index.npy', index.as_unit('ns').asi8), ('values.npy', np.asfortranarray(df.to_numpy(dtype=np.float64)))):
+        with open(os.path.join(path, name + '.tmp'), 'wb') as f:
+            np.save(f, v)
+        os.replace(os.path.join(path, name + '.tmp'), os.path.join(path, name))
+    with open(os.path.join(path, 'columns.json'), 'w') as f:
+        json.dump(meta, f)
+
+# save_format: (reader, writer), parquet and feather need pyarrow
+CANDLE_FORMATS = {
+    'csv':(read_csv, write_csv),
+    'parquet':(read_parquet, write_parquet),
+    'feather':(read_feather, write_feather),
+    'npy':(read_npy, write_npy),
+    }
+
+# Broker settings of runsaver
+BROKER = {'cash':1000, 'commission':0.00495, 'margin':1.0, 'trade_on_close':True, 'exclusive_orders':True}
+
+# runsaver artifacts per policy: overview.csv, equity.csv and trade.csv, bokeh.html
+ARTIFACTS = {
+    'stats':('result',),
+    'tables':('result', 'equity', 'trade'),
+    'full':('result', 'equity', 'trade', 'html'),
+    }
+
+class ArtifactWriter:
+    '''
+    Background writer for runsaver(writer=...), so results are saved while the next backtest runs.
+    At most max_pending writes are queued, submit() blocks beyond that.
+    flush() waits for the queued writes and raises the first error, close() also stops the threads.
+    '''
+    def __init__(self, max_workers=2, max_pending=64):
+        self.pool = ThreadPoolExecutor(max_workers=max_workers)
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.futures = []
+
+    def submit(self, func, *args, **kwargs):
+        self.slots.acquire()
+        try:
+            # Spans of the write belong to the run collecting in the submitting thread
+            future = self.pool.submit(timer.bind(func), *args, **kwargs)
+        except:
+            self.slots.release()
+            raise
+        future.add_done_callback(lambda _: self.slots.release())
+        self.futures.append(future)
+        return future
+
+    def flush(self):
+        futures, self.futures = self.futures, []
+        errors = [e for e in (future.exception() for future in futures) if e is not None]
+        if errors: raise errors[0]
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            self.pool.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
 class ObjectDB(metaclass = ABCMeta):
     @abstractmethod
     def reader(self):
@@ -45,24 +168,28 @@ class ObjectDB(metaclass = ABCMeta):
         return os.path.exists(path)
     
     def is_renew(self):
-        return (self.start < self.df_candle.index[0]) or (self.end > self.df_candle.index[-1]+td(days=1))
+        return len(self.missing_periods()) > 0
+
+    def missing_periods(self):
+        '''
+        Parts of the requested period not covered by self.period, as (start, end) for get_df_candle.
+        A period (start, end) holds the days start+1 .. end-1, see get_candle_from_yfinance.
+        '''
+        start, end = self.period
+        missing = []
+        if self.start < start: missing.append((self.start, start + td(days=1)))
+        if self.end > end: missing.append((end - td(days=1), self.end))
+        return missing
     
     def add_path(self, path):
         if (not self.is_path(path)) and ('.' not in path): os.mkdir(path)
 
-    def get_candle_from_yfinance(self):
-        '''
-        standard output
-            $start:(input 0714, output 0713), $end :(input 0721, output 0720)
-        $start is to +1, $end is to stay the same.
-        In Japan, the US market starts at night and ends in the morning.
-        Therefore, it is better to get the stock price one day before Japan time (=end) while the US market is closed.
-        '''
-        yf.pdr_override()
-        return web.get_data_yahoo(self.issue, data_source='yahoo', start=self.start+td(days=1), end=self.end)
-        
-    def get_df_candle(self):
-        if GET_CANDDLE == 'yfinance':return self.get_candle_from_yfinance()
+    def get_df_candle(self, start=None, end=None):
+        # Candle of the period (start, end) from self.source, see source.YFinanceSource.fetch
+        if start is None: start = self.start
+        if end is None: end = self.end
+        with timer.span('fetch', issue=self.issue):
+            return self.source.get(self.issue, start, end)
 
     def set_period(self, start, end):
         self.start, self.end = str_to_date(start), str_to_date(end)
@@ -80,9 +207,16 @@ class LocalDB(ObjectDB):
                 'LocalDB':root,
                 }
 
-    def __init__(self, path_localdb=get_path_localdb(), save_format=basic_format()):
+    def __init__(self, path_localdb=get_path_localdb(), save_format=basic_format(), indicator_cache=False, source=None, result_cache=False):
+        if save_format not in CANDLE_FORMATS: raise ValueError('save_format must be one of ' + ', '.join(CANDLE_FORMATS))
         self.save_format = save_format
+        # GET_CANDDLE is read now, so setting it switches the source of the LocalDBs made after
+        self.source = get_source(GET_CANDDLE if source is None else source)
+        # Persist indicator.cache of the backtests of an issue under <issue>/indicator/, see indicators()
+        self.indicator_cache = indicator_cache
         self.init_db(path_localdb)
+        # Reuse the results of identical backtests of this LocalDB (bst.result_cache), persisted under results/, see results()
+        self.result_cache = result_cache
 
     def init_db(self, root):
         self.path = self.init_path(root)
@@ -93,50 +227,303 @@ class LocalDB(ObjectDB):
             self.add_path(path)
 
     def reader(self):
-        if self.save_format=='csv':
-            self.df_candle = pd.read_csv(self.path['candle'], index_col=0)
-            self.df_candle.index = pd.to_datetime(self.df_candle.index, dayfirst=True)
+        with timer.span('reader', path=self.path['candle']):
+            self.df_candle = CANDLE_FORMATS[self.save_format][0](self.path['candle'])
+
+    def migrate(self, issues=None, src_format=basic_format()):
+        '''
+        Convert <issue>/candle.<src_format> to candle.<save_format> for issues (default: all in LocalDB).
+        '''
+        if issues is None: issues = sorted(os.listdir(self.path['LocalDB']))
+        migrated = []
+        for issue in issues:
+            src = self.path['LocalDB'] + issue + '/candle.' + src_format
+            dst = self.path['LocalDB'] + issue + '/candle.' + self.save_format
+            if src == dst or not self.is_path(src): continue
+            self.saver(CANDLE_FORMATS[src_format][0](src), dst)
+            migrated.append(issue)
+        return migrated
     
-    def loader(self, issue, start, end):
-        print(issue)
-        self.set_period(start, end)
-        self.issue = issue
-        self.path['issue'] = self.path['LocalDB'] + issue + '/'
-        self.path['candle']= self.path['issue'] + 'candle.' + self.save_format
-        self.reflect_path()
-        # xxx/candle.csv is not found
-        if not self.is_path(self.path['candle']):
-            self.df_candle = self.get_df_candle()
-            self.saver(self.df_candle, self.path['candle'])
-        # xxx/candle.csv is found
-        else:
-            self.reader()
-            # renew candle
-            if self.is_renew():self.saver(self.df_candle, self.path['candle'])
+    def loader(self, issue, start, end, timeframe=None):
+        '''
+        Candle of issue covering start .. end, fetched once and renewed with the missing days.
+        With timeframe ('W', 'M' or 'ND') the candle resampled by load_timeframe() is returned instead.
+        '''
+        with timer.span('loader', issue=issue):
+            self.set_period(start, end)
+            self.issue = issue
+            self.path['issue'] = self.path['LocalDB'] + issue + '/'
+            self.path['candle']= self.path['issue'] + 'candle.' + self.save_format
+            self.path['period']= self.path['issue'] + 'period.json'
+            self.reflect_path()
+            # candle.csv from before save_format was set
+            if not self.is_path(self.path['candle']): self.migrate([issue])
+            # xxx/candle.csv is not found
+            if not self.is_path(self.path['candle']):
+                self.df_candle = self.get_df_candle()
+                self.saver(self.df_candle, self.path['candle'])
+                self.period = (self.start, self.end)
+                self.write_period()
+            # xxx/candle.csv is found
+            else:
+                self.reader()
+                self.read_period()
+                # renew candle
+                if self.is_renew():self.renew()
+        if timeframe: return self.load_timeframe(timeframe)
         return self.df_candle
+
+    def load_timeframe(self, rule):
+        '''
+        Loaded candle resampled to rule (see timeframe.resample), stored as <issue>/candle_<rule>.<save_format>.
+        It is extended with the rows the candle gained since, and rebuilt when earlier days were added.
+        '''
+        path = self.path['issue'] + 'candle_' + rule + '.' + self.save_format
+        path_meta = self.path['issue'] + 'timeframe.json'
+        meta = {}
+        if self.is_path(path_meta):
+            with open(path_meta) as f:
+                meta = json.load(f)
+        base, stored = self.df_candle, meta.get(rule)
+        if stored and self.is_path(path) and stored['first'] == str(base.index[0]):
+            df = CANDLE_FORMATS[self.save_format][0](path)
+            if stored['last'] == str(base.index[-1]): return df
+            df = tf.extend(df, base, rule)
+        else:
+            df = tf.resample(base, rule)
+        self.saver(df, path)
+        meta[rule] = {'first':str(base.index[0]), 'last':str(base.index[-1])}
+        with open(path_meta, 'w') as f:
+            json.dump(meta, f)
+        return df
+
+    def load_many(self, issues, start, end, max_workers=8, errors='raise'):
+        '''
+        loader() for many issues, cached ones are read from disk and missing ones fetched concurrently.
+        Returns {issue: candle}. With errors='skip' failed issues are left out and kept in self.failed.
+        '''
+        def load(issue):
+            # Each thread gets its own issue/path/candle state
+            db = copy.copy(self)
+            db.path = dict(self.path)
+            return db.loader(issue, start, end)
+
+        candles, self.failed = {}, {}
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            futures = {issue:pool.submit(timer.bind(load), issue) for issue in issues}
+            for issue, future in futures.items():
+                try:
+                    candles[issue] = future.result()
+                except Exception as e:
+                    if errors == 'raise': raise
+                    self.failed[issue] = e
+        return candles
+
+    def read_period(self):
+        if self.is_path(self.path['period']):
+            with open(self.path['period']) as f:
+                period = json.load(f)
+            self.period = (str_to_date(period['start']), str_to_date(period['end']))
+        # Saved before period.json, assume exactly the stored days were requested
+        else:
+            self.period = (datetime_to_date(self.df_candle.index[0]) - td(days=1), datetime_to_date(self.df_candle.index[-1]) + td(days=1))
+
+    def write_period(self):
+        with open(self.path['period'], 'w') as f:
+            json.dump({'start':str(self.period[0]), 'end':str(self.period[1])}, f)
+
+    def renew(self):
+        '''
+        Fetch only the missing head and tail of the requested period and merge them into the stored candle.
+        Days already stored win over refetched ones, new tail rows are appended to csv.
+        '''
+        with timer.span('renew'):
+            fetched = [self.get_df_candle(start, end) for start, end in self.missing_periods()]
+            df = pd.concat([self.df_candle] + fetched)
+            df = df[~df.index.duplicated(keep='first')].sort_index()
+            new = df.index.difference(self.df_candle.index)
+            if len(new) and new[0] > self.df_candle.index[-1] and self.save_format == 'csv':
+                append_csv(df.loc[new], self.path['candle'])
+            elif len(new):
+                self.saver(df, self.path['candle'])
+            self.df_candle = df
+            self.period = (min(self.start, self.period[0]), max(self.end, self.period[1]))
+            self.write_period()
     
     def saver(self, df, path):
-        df.to_csv(path)
+        with timer.span('saver', path=path):
+            CANDLE_FORMATS[get_format(path)][1](df, path)
     
-    def runsaver(self, strategy):
-        self.path['strategy'] = self.path['issue'] + str(self.start) + '_' + str(self.end) + '_' + str(strategy.__name__) + '/'
-        self.path['equity'] = self.path['strategy'] + 'equity.' + self.save_format
-        self.path['trade'] = self.path['strategy'] + 'trade.' + self.save_format
-        self.path['result'] = self.path['strategy'] + 'overview.' + self.save_format
+    def strategy_path(self, strategy):
+        return self.path['issue'] + str(self.start) + '_' + str(self.end) + '_' + str(strategy.__name__) + '/'
+
+    def runsaver(self, strategy, profile=False, artifacts='full', writer=None, store=None):
+        '''
+        Backtest strategy and save the results under <issue>/<start>_<end>_<strategy>/.
+        artifacts is a policy of ARTIFACTS: 'stats' (overview.csv), 'tables' (+ equity.csv, trade.csv) or 'full' (+ bokeh.html),
+        plot() renders bokeh.html later on demand. With an ArtifactWriter the files are written in the background.
+        profile=True also saves a cProfile dump (profile.prof) and the time of each phase (timing.csv),
+        after the writer has written the files of this run.
+        With a store.ResultStore the run is also stored there, keyed by its indicator_params and, as optimizer.optimize
+        does, by the first and last bar of the candle, and aggregated by store.top() over the requested start .. end.
+        '''
+        if artifacts not in ARTIFACTS: raise ValueError('artifacts must be one of ' + ', '.join(ARTIFACTS))
+        self.path['strategy'] = self.strategy_path(strategy)
+        # Run results are not plain float tables, so they are always csv
+        self.path['equity'] = self.path['strategy'] + 'equity.csv'
+        self.path['trade'] = self.path['strategy'] + 'trade.csv'
+        self.path['result'] = self.path['strategy'] + 'overview.csv'
         self.reflect_path()
-        tester = bst.Btest(
-            strategy = strategy,
-            cash = 1000,
-            commission = 0.00495,
-            margin = 1.0,
-            trade_on_close = True,
-            exclusive_orders = True
-            )
-        df_result = tester.run()
-        tester.htmlsaver(self.path['strategy'] + 'bokeh')
-        df_equity = df_result['_equity_curve']
-        df_trade = df_result['_trades'].set_index('Size')
-        self.saver(df_equity, self.path['equity'])
-        self.saver(df_trade, self.path['trade'])
-        self.saver(df_result, self.path['result'])
+        with timer.collect(profile=self.path['strategy'] + 'profile.prof') if profile else contextlib.nullcontext() as run:
+            with timer.span('runsaver', strategy=strategy.__name__):
+                df_result, writes = self._runsaver(strategy, ARTIFACTS[artifacts], writer)
+            # The spans of the background writes belong to timing.csv too
+            if profile: wait(writes)
+        if profile: run.report().to_csv(self.path['strategy'] + 'timing.csv')
+        if store is not None:
+            # Strategies without indicator_params only have ObjectStrategy's property
+            params = strategy.indicator_params if isinstance(strategy.indicator_params, dict) else {}
+            store.put(df_result, self.issue, df_result['Start'], df_result['End'], strategy, params, BROKER, (self.start, self.end))
         return df_result
+
+    @staticmethod
+    def tester(strategy):
+        return bst.Btest(strategy = strategy, **BROKER)
+
+    def indicators(self):
+        # Context of the backtests of the loaded issue, their indicators are persisted under <issue>/indicator/
+        if not self.indicator_cache: return contextlib.nullcontext()
+        return indicator.cache.directory(self.path['issue'] + 'indicator/')
+
+    def results(self):
+        # Context of the backtests of this LocalDB, bst.result_cache is on inside it only
+        if not self.result_cache: return contextlib.nullcontext()
+        return bst.result_cache.directory(self.path['LocalDB'] + 'results/')
+
+    def _runsaver(self, strategy, artifacts, writer):
+        tester = self.tester(strategy)
+        with self.indicators(), self.results():
+            df_result = tester.run()
+        # Paths are taken now, self.path changes with the next run while the writer works
+        writes = []
+        if 'html' in artifacts: writes.append((tester.htmlsaver, self.path['strategy'] + 'bokeh'))
+        if 'equity' in artifacts: writes.append((self.saver, df_result['_equity_curve'], self.path['equity']))
+        if 'trade' in artifacts: writes.append((self.saver, df_result['_trades'].set_index('Size'), self.path['trade']))
+        if 'result' in artifacts: writes.append((self.saver, df_result, self.path['result']))
+        futures = []
+        for func, *args in writes:
+            if writer: futures.append(writer.submit(func, *args))
+            else: func(*args)
+        return df_result, futures
+
+    def plot(self, strategy, open_browser=False):
+        '''
+        Render bokeh.html of a runsaver() run that skipped it, by backtesting strategy again on the loaded candle.
+        '''
+        path = self.strategy_path(strategy)
+        self.add_path(path)
+        tester = self.tester(strategy)
+        with self.indicators(), self.results():
+            tester.run()
+        tester.htmlsaver(path + 'bokeh', open_browser=open_browser)
+        return path + 'bokeh.html'
+
+
+class PartitionedDB(ObjectDB):
+    '''
+    Intraday candles in time partitions, <LocalDB>/<issue>/<freq>/<partition>.<save_format> with one file
+    per month (partition='M'), year ('Y') or day ('D'). Loads read only the partitions overlapping the period,
+    npy partitions are memory-mapped. Candles are added with store(), e.g. from a broker's minute bar export.
+    '''
+    PARTITIONS = {'Y':'%Y', 'M':'%Y-%m', 'D':'%Y-%m-%d'}
+
+    def __init__(self, path_localdb=LocalDB.get_path_localdb(), save_format='npy', freq='1min', partition='M'):
+        if save_format not in CANDLE_FORMATS: raise ValueError('save_format must be one of ' + ', '.join(CANDLE_FORMATS))
+        if partition not in self.PARTITIONS: raise ValueError('partition must be one of ' + ', '.join(self.PARTITIONS))
+        self.save_format, self.freq, self.partition = save_format, freq, partition
+        self.path = {'LocalDB':path_localdb}
+        self.add_path(path_localdb)
+
+    def set_period(self, start, end):
+        # Dates ('2021-01-04') or wall times ('2021-01-04 09:30'), an end date includes its whole day
+        self.start, self.end = pd.Timestamp(start), pd.Timestamp(end)
+        if self.is_str(end) and len(end) <= 10: self.end += td(days=1) - pd.Timedelta(1)
+
+    def partition_dir(self, issue):
+        return self.path['LocalDB'] + issue + '/' + self.freq + '/'
+
+    @staticmethod
+    def wall(index):
+        # Wall time of the exchange, not UTC, periods and partitions are in wall time
+        return index.tz_localize(None) if index.tz is not None else index
+
+    def partition_keys(self, index):
+        return self.wall(index).to_period(self.partition)
+
+    def partitions(self, issue, start=None, end=None):
+        '''
+        Sorted [(period, path)] of the stored partitions of issue overlapping start .. end.
+        '''
+        root = self.partition_dir(issue)
+        if not self.is_path(root): return []
+        found = []
+        for name in os.listdir(root):
+            key, ext = os.path.splitext(name)
+            if ext != '.' + self.save_format: continue
+            period = pd.Period(key, self.partition)
+            if start is not None and period.end_time < start: continue
+            if end is not None and period.start_time > end: continue
+            found.append((period, root + name))
+        return sorted(found)
+
+    def reader(self, path):
+        with timer.span('reader', path=path):
+            return CANDLE_FORMATS[self.save_format][0](path)
+
+    def saver(self, df, path):
+        with timer.span('saver', path=path):
+            CANDLE_FORMATS[get_format(path)][1](df, path)
+
+    def store(self, issue, df):
+        '''
+        Merge df into the partitions of issue, rows already stored win as in LocalDB.renew.
+        '''
+        root = self.partition_dir(issue)
+        os.makedirs(root, exist_ok=True)
+        keys = self.partition_keys(df.index)
+        for key in keys.unique():
+            part = df[keys == key]
+            path = root + key.strftime(self.PARTITIONS[self.partition]) + '.' + self.save_format
+            if self.is_path(path):
+                part = pd.concat([self.reader(path), part])
+                part = part[~part.index.duplicated(keep='first')]
+            self.saver(part.sort_index(), path)
+
+    def chunks(self, issue, start, end, warmup=0):
+        '''
+        Yield (candle, n) per partition overlapping start .. end, candle starts with n rows carried over from
+        the previous partitions (at most warmup), so indicators of each chunk are warmed up.
+        See indicator.chunked and vectorized.run_chunks.
+        '''
+        self.set_period(start, end)
+        carry = None
+        for _, path in self.partitions(issue, self.start, self.end):
+            df = self.reader(path)
+            index = self.wall(df.index)
+            df = df[(index >= self.start) & (index <= self.end)]
+            if not len(df): continue
+            n = 0 if carry is None else len(carry)
+            chunk = df if not n else pd.concat([carry, df])
+            yield chunk, n
+            carry = chunk.iloc[-warmup:] if warmup else None
+
+    def loader(self, issue, start, end):
+        '''
+        Candle of issue from start to end (dates or times), read from the overlapping partitions only.
+        '''
+        with timer.span('loader', issue=issue):
+            self.issue = issue
+            parts = [chunk for chunk, _ in self.chunks(issue, start, end)]
+            if not parts: raise FileNotFoundError('no %s bars of %s from %s to %s in %s' % (self.freq, issue, start, end, self.partition_dir(issue)))
+            self.df_candle = pd.concat(parts) if len(parts) > 1 else parts[0]
+        return self.df_candle
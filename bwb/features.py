@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+import inspect
+import pandas as pd
+import numpy as np
+
+try:
+    from . import indicator
+except:
+    import indicator
+
+class Graph:
+    '''
+    Intermediate series of a candle by key, each evaluated once, e.g. g('sma', 20) is shared by ci and maer.
+    A key is (node, *args), args may be keys of other nodes.
+    '''
+    def __init__(self, candle):
+        self.candle = candle
+        self.nodes = {}
+
+    def __call__(self, node, *args):
+        key = (node,) + args
+        if key not in self.nodes:
+            self.nodes[key] = NODES[node](self, *args)
+        return self.nodes[key]
+
+# Intermediates, the same pandas operations as bwb.indicator so that features equal the indicators
+
+def _tr(g):
+    a = (g.candle['High'] - g.candle['Low']).abs()
+    b = (g.candle['High'] - g('prev', 'Close')).abs()
+    c = (g.candle['Low'] - g('prev', 'Close')).abs()
+    return pd.concat([a, b, c], axis=1).max(axis=1)
+
+def _dm(g):
+    dm_p = g.candle['High'] - g('prev', 'High')
+    dm_m = g('prev', 'Low') - g.candle['Low']
+    dm_p.loc[dm_p<0] = 0
+    dm_m.loc[dm_m<0] = 0
+    dm_p.loc[dm_p-dm_m <= 0] = 0
+    dm_m.loc[dm_p-dm_m >= 0] = 0
+    return dm_p, dm_m
+
+def _updown(g):
+    up, down = g('diff').copy(), g('diff').copy()
+    up[up <= 0] = 0
+    down[down > 0] = 0
+    return up, down
+
+def _win(g):
+    win = g.candle['Close'].copy()
+    win.loc[g('diff') > 0] = 1
+    win.loc[g('diff') <= 0] = 0
+    return win
+
+def _fast(g, maxmin_span, k_span):
+    low_min  = g.candle['Low'].rolling(window=maxmin_span).min()
+    high_max = g.candle['High'].rolling(window=maxmin_span).max()
+    fast_per_k = 100 * (g.candle['Close'] - low_min) / (high_max - low_min)
+    return fast_per_k, fast_per_k.rolling(window = k_span).mean()
+
+def _di(g, span):
+    tr = g('sum', ('tr',), span)
+    return g('sum', ('dm', 0), span) / tr * 100, g('sum', ('dm', 1), span) / tr * 100
+
+NODES = {
+    'prev':lambda g, column: g.candle[column].shift(1),
+    'diff':lambda g: g.candle['Close'].diff(),
+    'sma':lambda g, day: pd.Series(data=g.candle['Close']).rolling(window = day).mean(),
+    'std':lambda g, day: pd.Series(data=g.candle['Close']).rolling(window = day).std(),
+    'ewm':lambda g, source, span: g(*source).ewm(span=span).mean(),
+    'close':lambda g: g.candle['Close'],
+    'macd':lambda g, short, long: g('ewm', ('close',), short) - g('ewm', ('close',), long),
+    'tr':_tr,
+    'dm':lambda g, i: g('dms')[i],
+    'dms':_dm,
+    'sum':lambda g, source, span: g(*source).rolling(span).sum(),
+    'di':_di,
+    'updown':_updown,
+    'up':lambda g: g('updown')[0],
+    'down':lambda g: g('updown')[1],
+    'win':_win,
+    'fast':_fast,
+    }
+
+# Features: the outputs of an indicator of bwb.indicator from the graph, with their column suffixes
+
+def _adx(g, span):
+    di_p, di_m = g('di', span)
+    dx = ((di_p - di_m).abs() / (di_p + di_m) * 100)
+    return dx.rolling(span).mean()
+
+def _rsi(g, span):
+    up_sma = g('sum', ('up',), span).abs()
+    down_sma = g('sum', ('down',), span).abs()
+    return 100 - (100 / (1.0 + (up_sma / down_sma)))
+
+FEATURES = {
+    'sma':(lambda g, day: g('sma', day), None),
+    'sigma':(lambda g, day: g('std', day), None),
+    'ema':(lambda g, day: g('ewm', ('close',), day), None),
+    'macd':(lambda g, day_short, day_long, span: (g('macd', day_short, day_long), g('ewm', ('macd', day_short, day_long), span)), ('macd', 'signal')),
+    'ci':(lambda g, day, upper_sigma, lower_sigma: (g('sma', day) + g('std', day) * upper_sigma, g('sma', day) - g('std', day) * lower_sigma), ('upper', 'lower')),
+    'di':(lambda g, span: g('di', span), ('plus', 'minus')),
+    'tr':(lambda g: g('tr'), None),
+    'adx':(_adx, None),
+    'sar':(lambda g, iaf, maxaf: indicator.sar(g.candle, iaf, maxaf), ('sar', 'bear', 'bull')),
+    'rsi':(_rsi, None),
+    'fast_s':(lambda g, maxmin_span, k_span: g('fast', maxmin_span, k_span), ('k', 'd')),
+    'slow_s':(lambda g, maxmin_span, k_span: (g('fast', maxmin_span, k_span)[1], g('fast', maxmin_span, k_span)[1].rolling(window=k_span).mean()), ('k', 'd')),
+    'psyco':(lambda g, span: g('sum', ('win',), span) / span * 100, None),
+    'rci':(lambda g, span: indicator._rci(np.asarray(g.candle['Close'], dtype=float), int(span)), None),
+    'maer':(lambda g, span: (g.candle['Close'] - g('sma', span)) / g('sma', span) * 100, None),
+    }
+
+def parse(item):
+    '''
+    (name, params) of a spec item: 'sma', ('sma', 25), ('ci', 20, 2, 2) or ('macd', {'span':9}),
+    params are ordered and completed with the defaults of the indicator.
+    '''
+    name, args, kwargs = (item, (), {}) if isinstance(item, str) else (item[0], item[1:], {})
+    if len(args) == 1 and isinstance(args[0], dict): args, kwargs = (), args[0]
+    if name not in FEATURES: raise ValueError('unknown indicator %r, one of %s' % (name, ', '.join(FEATURES)))
+    try:
+        bound = inspect.signature(getattr(indicator, name)).bind(None, *args, **kwargs)
+    except TypeError as e:
+        raise ValueError('%s: %s' % (name, e)) from None
+    bound.apply_defaults()
+    return name, tuple(bound.arguments.values())[1:]
+
+def compute_features(candle, spec, dtype=np.float64):
+    '''
+    Indicators of spec (see parse) on candle as one DataFrame backed by a single contiguous dtype matrix,
+    columns are named <indicator>_<params>[_<output>], e.g. sma_25, ci_20_2_2_upper.
+    Shared intermediates (sma of ci and maer, tr and the ±DM sums of di and adx, fast_s of slow_s,
+    the Close diff of rsi and psyco, ...) are computed once. Values equal the functions of bwb.indicator.
+    '''
+    g = Graph(candle)
+    columns, series = [], []
+    for name, params in dict.fromkeys(map(parse, spec)):
+        func, outputs = FEATURES[name]
+        values = func(g, *params)
+        prefix = '_'.join([name] + [str(p) for p in params])
+        if outputs is None: values, outputs = (values,), ('',)
+        for output, v in zip(outputs, values):
+            columns.append(prefix + '_' + output if output else prefix)
+            series.append(v)
+    matrix = np.empty((len(candle), len(series)), dtype=dtype, order='F')
+    for i, v in enumerate(series):
+        matrix[:, i] = np.asarray(v, dtype=float)
+    return pd.DataFrame(matrix, index=candle.index, columns=columns, copy=False)
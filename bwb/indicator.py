@@ -1,26 +1,105 @@
 import pandas as pd
 import numpy as np
 
+try:
+    from .cache import IndicatorCache, cut
+except:
+    from cache import IndicatorCache, cut
+
+# Memoizes the indicators below, shared by every backtest in the process
+cache = IndicatorCache()
+
+ROLLING_CHUNK = 1 << 12
+
+def _prefix(x):
+    # Prefix sums of x as high + low parts, low accumulates the exact rounding error of each step (TwoSum)
+    high = np.concatenate(([0.0], np.cumsum(x)))
+    prev, total = high[:-1], high[1:]
+    added = total - prev
+    error = (prev - (total - added)) + (x - added)
+    return high, np.concatenate(([0.0], np.cumsum(error)))
+
+def _rolling_moments(x, windows, var=True):
+    # Rolling mean (and sample variance) of x over each of windows as (windows x bars) arrays,
+    # nan until a window is full or while it holds a nan, as pandas rolling(w).mean() / .var().
+    # Every window comes from the same compensated prefix sums of x and x**2. They restart every ROLLING_CHUNK
+    # bars around the chunk's mean, so their rounding error grows neither with the bars nor with the price level.
+    x = np.asarray(x, dtype=float)
+    windows = np.asarray(windows, dtype=int).ravel()
+    if (windows < 1).any(): raise ValueError('windows must be >= 1')
+    n = len(x)
+    mean = np.full((len(windows), n), np.nan)
+    variance = np.full((len(windows), n), np.nan) if var else None
+    if n == 0 or len(windows) == 0: return mean, variance
+    missing = np.isnan(x)
+    reach = windows.max() - 1
+    for lo in range(0, n, ROLLING_CHUNK):
+        hi = min(lo + ROLLING_CHUNK, n)
+        base = max(lo - reach, 0)
+        seg, holes = x[base:hi], missing[base:hi]
+        shift = seg[~holes].mean() if (~holes).any() else 0.0
+        seg = np.where(holes, 0.0, seg - shift)
+        count = np.concatenate(([0], np.cumsum(holes))) if holes.any() else None
+        p1, c1 = _prefix(seg)
+        if var: p2, c2 = _prefix(seg * seg)
+        for j, w in enumerate(windows):
+            # bars first..hi-1 of the chunk have a full window, prefix positions e - w .. e
+            first = max(lo, w - 1)
+            if first >= hi: continue
+            e = slice(first - base + 1, hi - base + 1)
+            b = slice(first - base + 1 - w, hi - base + 1 - w)
+            s1 = (p1[e] - p1[b]) + (c1[e] - c1[b])
+            mean[j, first:hi] = s1 / w + shift
+            if var and w > 1:
+                v = ((p2[e] - p2[b]) + (c2[e] - c2[b]) - s1 * s1 / w) / (w - 1)
+                variance[j, first:hi] = np.maximum(v, 0.0)
+            if count is not None:
+                invalid = first + np.flatnonzero(count[e] - count[b] > 0)
+                mean[j, invalid] = np.nan
+                if var: variance[j, invalid] = np.nan
+    return mean, variance
+
+# sma, sigma, ci, psyco and maer take an array of windows too and return (windows x bars) arrays
+# from one pass of _rolling_moments, equal to the per-window pandas results up to rounding.
+
+@cache.memoize('Close')
 def sma(data, day=5):
+    if np.ndim(day):
+        return _rolling_moments(data['Close'], day, var=False)[0]
     return pd.Series(data=data['Close']).rolling(window = day).mean()
 
+@cache.memoize('Close')
 def sigma(data, day=5):
+    if np.ndim(day):
+        return np.sqrt(_rolling_moments(data['Close'], day)[1])
     return pd.Series(data=data['Close']).rolling(window = day).std()
 
+@cache.memoize('Close')
 def ema(data, day=5):
     # Exponential Moving Average.
     return data['Close'].ewm(span=day).mean()
 
+@cache.memoize('Close')
 def macd(data, day_short=12, day_long=26, span=9):
     macd = ema(data, day_short) - ema(data, day_long)
     macdsignal = macd.ewm(span=span).mean()
     return macd, macdsignal
 
+@cache.memoize('Close')
 def ci(data, day=20, upper_sigma=2, lower_sigma=2):
     # Confidence interval
+    # Arrays of day and sigmas broadcast together, each band is then (broadcast shape x bars).
+    if np.ndim(day) or np.ndim(upper_sigma) or np.ndim(lower_sigma):
+        day, upper_sigma, lower_sigma = np.broadcast_arrays(day, upper_sigma, lower_sigma)
+        windows, inverse = np.unique(day.ravel(), return_inverse=True)
+        mean, variance = _rolling_moments(data['Close'], windows)
+        shape = day.shape + (len(data['Close']),)
+        _sma, _sigma = mean[inverse].reshape(shape), np.sqrt(variance)[inverse].reshape(shape)
+        return _sma + _sigma * upper_sigma[..., None], _sma - _sigma * lower_sigma[..., None]
     _sma, _sigma = sma(data, day), sigma(data, day)
     return _sma + _sigma * upper_sigma, _sma - _sigma * lower_sigma
 
+@cache.memoize('High', 'Low', 'Close')
 def di(data, span=14):
     # Direction Movement (±DM)
     dm_p = data['High'] - data['High'].shift(1)
@@ -34,6 +113,7 @@ def di(data, span=14):
     # Direction Indicator (±DI)
     return dm_p.rolling(span).sum()/_tr.rolling(span).sum() * 100, dm_m.rolling(span).sum()/_tr.rolling(span).sum() * 100
 
+@cache.memoize('High', 'Low', 'Close')
 def tr(data):
     # True Range (TR)
     a = (data['High'] - data['Low']).abs()
@@ -41,6 +121,7 @@ def tr(data):
     c = (data['Low'] - data['Close'].shift(1)).abs()
     return pd.concat([a, b, c], axis=1).max(axis=1)
 
+@cache.memoize('High', 'Low', 'Close')
 def adx(data, span=14):
     # Direction Indicator (±DI)
     di_p, di_m = di(data, span)
@@ -49,14 +130,11 @@ def adx(data, span=14):
     # Average Directional Index
     return dx.rolling(span).mean()
 
-def sar(data, iaf=0.02, maxaf=0.2):
+def _sar_list(high, low, close, iaf, maxaf):
     # Refer to https://github.com/soshika/stock_marketing/blob/master/indicators/parabolicSAR.py
     # Stop And Reverse Point
     # AF(Acceleration Factor), EP(Extreme Price)
-    length = len(data)
-    high = list(data['High'])
-    low = list(data['Low'])
-    close = list(data['Close'])
+    length = len(close)
     psar = close[0:len(close)]
     psarbull = [None] * length
     psarbear = [None] * length
@@ -106,8 +184,80 @@ def sar(data, iaf=0.02, maxaf=0.2):
             psarbull[i] = psar[i]
         else:
             psarbear[i] = psar[i]
+    return psar, psarbear, psarbull
+
+def _sar(high, low, close, iaf, maxaf):
+    # All parameter sets stepped per bar over (sets,) state arrays, same results as _sar_list.
+    # Prices are signed (bear negated) so both trends share one comparison, nes is minus the extreme point,
+    # the trend picks bear (0-2) or bull (4-6) columns of the bar table: nfav, adv and the 2-bar bound.
+    # af is looked up from a per-set ladder of min(af + iaf, maxaf) by level, reset on reversal.
+    k, length = len(iaf), len(close)
+    # NaN bounds never bind, like max()/min() skipping NaN in _sar_list
+    with np.errstate(invalid='ignore'):
+        lowmin = np.fmin(low[1:-1], low[:-2])
+        highmax = np.fmax(high[1:-1], high[:-2])
+    lowmin[np.isnan(lowmin)], highmax[np.isnan(highmax)] = np.inf, -np.inf
+    table = np.zeros((length, 8))
+    table[2:, 0], table[2:, 1], table[2:, 2] = low[2:], -high[2:], -highmax
+    table[2:, 4], table[2:, 5], table[2:, 6] = -high[2:], low[2:], lowmin
+    ladder = np.empty((k, length))
+    ladder[:, 0] = iaf
+    for n in range(1, length):
+        ladder[:, n] = np.minimum(ladder[:, n - 1] + iaf, maxaf)
+        if (ladder[:, n] == ladder[:, n - 1]).all():
+            ladder[:, n:] = ladder[:, n, None]
+            break
+    ladder = ladder.ravel()
+    base = np.arange(k) * length
+    level = base.copy()
+    # state rows interleave p and nes per bar, index holds each set's table columns
+    state = np.empty((2 * length, k))
+    state[0], state[2] = close[0], close[1]
+    state[1] = state[3] = -high[0]
+    index = np.empty((3, k), dtype=np.intp)
+    index[:] = 4 + np.arange(3)[:, None]
+    flips = np.zeros((length, k), dtype=np.intp)
+    af = iaf.copy()
+    t = np.empty(k)
+    rows = zip(table[2:], state[2:-2:2], state[3:-2:2], state[4::2], state[5::2],
+        state[3:-1].reshape(length - 2, 2, k), flips[2:])
+    for bar, prev, nes, p, nes_next, pair, flip in rows:
+        np.add(nes, prev, out=t)
+        t *= af
+        np.subtract(prev, t, out=p)
+        row = bar.take(index)
+        mask = row[:2] < pair
+        rev = mask[1]
+        np.fmin(nes, row[0], out=nes_next)
+        np.minimum(p, row[2], out=p)
+        level += mask[0]
+        if np.count_nonzero(rev):
+            np.copyto(p, nes, where=rev)
+            np.multiply(rev, 4, out=flip)
+            index ^= flip
+            np.copyto(nes_next, bar.take(index[0]), where=rev)
+            np.copyto(level, base, where=rev)
+        ladder.take(level, out=af)
+    # Trend per bar is the parity of reversals so far
+    bull = np.bitwise_xor.accumulate(flips, axis=0) == 0
+    ps = state[0::2]
+    psar = np.where(bull, ps, -ps).T
+    bull = bull.T
+    started = np.arange(length) >= 2
+    return psar, np.where(started & ~bull, psar, np.nan), np.where(started & bull, psar, np.nan)
+
+@cache.memoize('High', 'Low', 'Close')
+def sar(data, iaf=0.02, maxaf=0.2):
+    # Parabolic SAR, returns psar, psarbear, psarbull
+    # Arrays of iaf/maxaf are broadcast into parameter sets and return (params x bars) arrays.
+    if np.ndim(iaf) or np.ndim(maxaf):
+        iaf, maxaf = (np.array(v, dtype=float).ravel() for v in np.broadcast_arrays(iaf, maxaf))
+        high, low, close = (np.array(data[c], dtype=float) for c in ('High', 'Low', 'Close'))
+        return _sar(high, low, close, iaf, maxaf)
+    psar, psarbear, psarbull = _sar_list(list(data['High']), list(data['Low']), list(data['Close']), iaf, maxaf)
     return pd.Series(data=psar, index=data.index), pd.Series(data=psarbear, index=data.index), pd.Series(data=psarbull, index=data.index)
 
+@cache.memoize('Close')
 def rsi(data, span):
     # Relative Strength Index
     diff = data['Close'].diff()
@@ -118,6 +268,7 @@ def rsi(data, span):
     down_sma = down.rolling(window=span).sum().abs()
     return 100 - (100 / (1.0 + (up_sma / down_sma)))
 
+@cache.memoize('High', 'Low', 'Close')
 def fast_s(data, maxmin_span=9, k_span=3):
     # Fast Stochastics
     low_min  = data['Low'].rolling(window=maxmin_span).min()
@@ -126,36 +277,74 @@ def fast_s(data, maxmin_span=9, k_span=3):
     fast_per_d = fast_per_k.rolling(window = k_span).mean()
     return fast_per_k, fast_per_d
 
+@cache.memoize('High', 'Low', 'Close')
 def slow_s(data, maxmin_span=9, k_span=3):
     # Slow Stochastics
     _, fast_per_d = fast_s(data, maxmin_span, k_span)
     slow_per_k, slow_per_d = fast_per_d, fast_per_d.rolling(window=k_span).mean()
     return slow_per_k, slow_per_d
 
+@cache.memoize('Close')
 def psyco(data, span=12):
     close = data['Close'].shift(1)
     win = data['Close'].copy()
     win.loc[data['Close']-close > 0] = 1
     win.loc[data['Close']-close <= 0] = 0
+    if np.ndim(span):
+        return _rolling_moments(win, span, var=False)[0] * 100
     return win.rolling(span).sum() / span * 100
 
+RCI_CHUNK = 1 << 16
+
+def _rci(close, span):
+    # Spearman rank correlation of each window against time, ranks of equal prices
+    # are the rank of their first occurrence in descending order (as list.index did).
+    result = np.full(len(close), np.nan)
+    if len(close) < span: return result
+    windows = np.lib.stride_tricks.sliding_window_view(close, span)
+    pos = np.arange(span)
+    time_rank = span - pos
+    for lo in range(0, len(windows), RCI_CHUNK):
+        w = windows[lo:lo+RCI_CHUNK]
+        order = np.argsort(w, axis=1, kind='stable')
+        s = np.take_along_axis(w, order, axis=1)
+        # ascending position of the last element of each run of equal prices
+        run_end = np.ones(s.shape, dtype=bool)
+        run_end[:, :-1] = s[:, 1:] != s[:, :-1]
+        last = np.minimum.accumulate(np.where(run_end, pos, span)[:, ::-1], axis=1)[:, ::-1]
+        price_rank = np.empty_like(last)
+        np.put_along_axis(price_rank, order, span - last, axis=1)
+        d = ((time_rank - price_rank) ** 2).sum(axis=1)
+        rci = 6*d / (span * (span*span - 1))
+        result[span-1+lo:span-1+lo+len(w)] = (1 - rci) * 100
+    return result
+
+@cache.memoize('Close')
 def rci(data, span=9):
     # Refer to https://note.com/sakiyama100/n/n935c8ba24aac
-    result = [None] * (span - 1)
-    for end in range(span-1, len(data['Close'])):
-        start = end - span + 1
-        target = data['Close'].iloc[start:end+1]
-        target_sorted = sorted(target,reverse=True)
-        i, d = 0, 0
-        while i < span:
-            time_rank = span - i
-            price_rank = target_sorted.index(target[i]) +1 
-            d = d + ((time_rank - price_rank)*(time_rank - price_rank))
-            i += 1
-        rci = 6*d  / (span * (span*span -1))
-        rci = (1-rci) * 100
-        result.append(rci)
-    return pd.Series(data=result, index=data.index)
+    # An array of spans returns a (spans x bars) array.
+    close = np.asarray(data['Close'], dtype=float)
+    if np.ndim(span):
+        return np.vstack([_rci(close, int(s)) for s in span])
+    return pd.Series(data=_rci(close, int(span)), index=data.index)
 
+@cache.memoize('Close')
 def maer(data, span=25):
-    return (data['Close'] - sma(data, span)) / sma(data, span) * 100
\ No newline at end of file
+    if np.ndim(span):
+        _sma = sma(data, span)
+        return (np.asarray(data['Close'], dtype=float) - _sma) / _sma * 100
+    return (data['Close'] - sma(data, span)) / sma(data, span) * 100
+
+def chunked(func, chunks, *args, **kwargs):
+    '''
+    Indicator func over (candle, n) chunks such as PartitionedDB.chunks(): computed per chunk and joined
+    without the n rows carried over. Equal to func on the whole candle (up to rounding) when the rows carried
+    cover the indicator's window, ema and sar converge instead, bwb.stream carries their exact state.
+    '''
+    parts = [cut(func(candle, *args, **kwargs), n, None) for candle, n in chunks]
+    if isinstance(parts[0], tuple): return tuple(join(list(p)) for p in zip(*parts))
+    return join(parts)
+
+def join(parts):
+    if isinstance(parts[0], (pd.Series, pd.DataFrame)): return pd.concat(parts)
+    return np.concatenate(parts, axis=-1)
@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+import importlib.util, sys
+
+def lazy(name, package=None):
+    '''
+    Module name (relative to package when given), executed on its first attribute access.
+    For heavy dependencies only some code paths use, e.g. backtesting (and bokeh) for a cached-data job.
+    '''
+    name = package + '.' + name if package else name
+    if name in sys.modules: return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None: raise ModuleNotFoundError('No module named %r' % name, name=name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
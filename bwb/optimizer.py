@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+import itertools, os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import pandas as pd
+import numpy as np
+
+try:
+    from .lazy import lazy
+    from .store import dumps
+except:
+    from lazy import lazy
+    from store import dumps
+
+# backtesting is loaded by the first backtest, a resumed job whose runs are all stored never needs it
+bst = lazy('basicstrategy', __package__)
+
+METRIC = 'Equity Final [$]'
+
+def to_python(v):
+    return v.item() if isinstance(v, np.generic) else v
+
+def grid(params):
+    '''
+    Expand base_indicator_params() style {name: array} into a list of {name: value}.
+    '''
+    keys = list(params)
+    return [dict(zip(keys, map(to_python, values))) for values in itertools.product(*(params[k] for k in keys))]
+
+def bind(strategy, candle, params):
+    # Subclass instead of mutating strategy.candle / strategy.indicator_params,
+    # so concurrent runs of the same strategy never see each other's settings.
+    return type(strategy.__name__, (strategy,), {'candle':candle, 'indicator_params':params})
+
+def backtest(strategy, candle, params, **broker):
+    return bst.Btest(bind(strategy, candle, params), **broker).run()
+
+def stats(result):
+    return result[[k for k in result.index if not k.startswith('_')]]
+
+# State of a pool worker, filled once by _init_worker
+_worker = {}
+
+def _init_worker(strategy, candle, broker):
+    _worker['strategy'] = strategy
+    _worker['candle'] = candle
+    _worker['broker'] = broker
+
+def _run(params):
+    result = backtest(_worker['strategy'], _worker['candle'], params, **_worker['broker'])
+    return stats(result)
+
+def _run_many(tasks):
+    # (index, params) pairs, returned with the stats of each
+    return [(i, _run(params)) for i, params in tasks]
+
+def rank(df, metric=METRIC, maximize=True):
+    return df.sort_values(metric, ascending=not maximize, na_position='last', kind='stable').reset_index(drop=True)
+
+def optimize(strategy, candle, params=None, metric=METRIC, maximize=True, processes=None, chunksize=1, search=None, store=None, issue=None, period=None, **broker):
+    '''
+    Backtest every combination of params (default: strategy.base_indicator_params())
+    and return a DataFrame of params and stats ranked by metric.
+    The candle is sent to each worker process once, not once per combination.
+    processes=1 runs in the current process.
+    search (e.g. search.SuccessiveHalving()) backtests only part of the grid instead, see search.ObjectSearch.
+    With a store.ResultStore each combination is stored as it completes, keyed by issue and the candle's first
+    and last bar, and combinations already stored are not backtested again, so an interrupted run resumes.
+    period is the (start, end) the candle was loaded for, store.top() aggregates issues by it (default: the candle's bounds).
+    '''
+    if search is not None:
+        if store is not None: raise ValueError('store is not supported with search')
+        return search.search(strategy, candle, params, metric, maximize, **broker)
+    if store is not None and issue is None: raise ValueError('store needs the issue of candle')
+    combos = grid(strategy.base_indicator_params() if params is None else params)
+    rows = [None] * len(combos)
+    if store is not None:
+        bars = (candle.index[0], candle.index[-1])
+        done = store.journal(issue, *bars, strategy, broker)
+        runs = {i:done[dumps(p)] for i, p in enumerate(combos) if dumps(p) in done}
+        for i, row in zip(runs, store.stats(runs.values())):
+            rows[i] = row
+    pending = [i for i, row in enumerate(rows) if row is None]
+    def collect(results):
+        for i, row in results:
+            rows[i] = row
+            if store is not None: store.put(row, issue, *bars, strategy, combos[i], broker, period)
+    if processes is None: processes = os.cpu_count() or 1
+    processes = min(processes, len(pending))
+    if processes <= 1:
+        _init_worker(strategy, candle, broker)
+        collect((i, _run(combos[i])) for i in pending)
+    else:
+        tasks = [(i, combos[i]) for i in pending]
+        with ProcessPoolExecutor(max_workers=processes, initializer=_init_worker, initargs=(strategy, candle, broker)) as pool:
+            futures = [pool.submit(_run_many, tasks[lo:lo+chunksize]) for lo in range(0, len(tasks), chunksize)]
+            try:
+                # Stored as each chunk completes, so an interruption keeps every finished backtest
+                for future in as_completed(futures):
+                    collect(future.result())
+            except BaseException:
+                for future in futures: future.cancel()
+                raise
+    df = pd.concat([pd.DataFrame(combos), pd.DataFrame(rows)], axis=1)
+    return rank(df, metric, maximize)
+
+def batch(db, issues, strategies, start, end, store, params=None, metric=METRIC, maximize=True, processes=None, chunksize=1, **broker):
+    '''
+    optimize() every strategy on the candle of every issue loaded by db (e.g. db.LocalDB()) for start .. end,
+    journaled in store (a store.ResultStore). Calling it again after an interruption skips the stored combinations,
+    store.query() / store.top() show the results so far from any process while it runs.
+    params is {strategy: params} for strategies whose grid is not base_indicator_params().
+    Returns {(issue, strategy name): DataFrame of optimize()}.
+    '''
+    results = {}
+    for issue in issues:
+        candle = db.loader(issue, start, end)
+        for strategy in strategies:
+            results[(issue, strategy.__name__)] = optimize(strategy, candle, (params or {}).get(strategy), metric, maximize,
+                processes, chunksize, store=store, issue=issue, period=(start, end), **broker)
+    return results
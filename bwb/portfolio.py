@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import pandas as pd
+import numpy as np
+
+try:
+    from . import optimizer
+except:
+    import optimizer
+
+class SharedCandles:
+    '''
+    Candles of many issues packed into two shared memory blocks, float64 values and int64 ns index,
+    so worker processes map them instead of unpickling a DataFrame per issue.
+    Only the small layout (spec) is pickled, attach(spec) maps the blocks in another process.
+    '''
+    def __init__(self, candles=None, spec=None):
+        if spec is None:
+            spec = self.pack(candles)
+        self.spec = spec
+        self.values_shm = shared_memory.SharedMemory(name=spec['values'])
+        self.index_shm = shared_memory.SharedMemory(name=spec['index'])
+        rows, columns = spec['rows'], spec['columns']
+        self.values = np.ndarray((rows, len(columns)), dtype=np.float64, buffer=self.values_shm.buf)
+        self.index = np.ndarray((rows,), dtype=np.int64, buffer=self.index_shm.buf)
+
+    @staticmethod
+    def pack(candles):
+        issues = list(candles)
+        # Columns every candle has, e.g. yfinance's Adj Close is dropped when a candle lacks it
+        columns = [c for c in candles[issues[0]].columns if all(c in candles[issue].columns for issue in issues)]
+        rows = sum(len(candles[issue]) for issue in issues)
+        values_shm = shared_memory.SharedMemory(create=True, size=max(rows * len(columns) * 8, 1))
+        index_shm = shared_memory.SharedMemory(create=True, size=max(rows * 8, 1))
+        values = np.ndarray((rows, len(columns)), dtype=np.float64, buffer=values_shm.buf)
+        index = np.ndarray((rows,), dtype=np.int64, buffer=index_shm.buf)
+        layout, offset = {}, 0
+        try:
+            for issue in issues:
+                df = candles[issue]
+                values[offset:offset+len(df)] = df[columns].to_numpy(dtype=np.float64)
+                # UTC nanoseconds, the timezone and unit are kept in the layout
+                index[offset:offset+len(df)] = pd.DatetimeIndex(df.index).as_unit('ns').asi8
+                layout[issue] = (offset, len(df), str(df.index.tz) if df.index.tz else None, df.index.unit, df.index.name)
+                offset += len(df)
+        except:
+            values, index = None, None
+            for shm in (values_shm, index_shm):
+                shm.close()
+                shm.unlink()
+            raise
+        spec = {'values':values_shm.name, 'index':index_shm.name, 'rows':rows, 'columns':columns, 'layout':layout}
+        # The blocks stay alive through the names, __init__ maps them again
+        values_shm.close()
+        index_shm.close()
+        return spec
+
+    @classmethod
+    def attach(cls, spec):
+        return cls(spec=spec)
+
+    def issues(self):
+        return list(self.spec['layout'])
+
+    def __getitem__(self, issue):
+        offset, n, tz, unit, name = self.spec['layout'][issue]
+        index = pd.DatetimeIndex(self.index[offset:offset+n].view('datetime64[ns]'), name=name).as_unit(unit)
+        if tz: index = index.tz_localize('UTC').tz_convert(tz)
+        return pd.DataFrame(self.values[offset:offset+n], index=index, columns=self.spec['columns'], copy=True)
+
+    def close(self):
+        self.values = self.index = None
+        self.values_shm.close()
+        self.index_shm.close()
+
+    def unlink(self):
+        self.values_shm.unlink()
+        self.index_shm.unlink()
+
+# State of a pool worker, filled once by _init_worker
+_worker = {}
+
+def _init_worker(strategy, spec, params, broker):
+    _worker['strategy'] = strategy
+    _worker['candles'] = SharedCandles.attach(spec)
+    _worker['params'] = params
+    _worker['broker'] = broker
+
+def _run(task):
+    issue, cash = task
+    candles = _worker['candles']
+    return backtest_issue(_worker['strategy'], candles[issue], _worker['params'], cash, **_worker['broker'])
+
+def backtest_issue(strategy, candle, params, cash, **broker):
+    result = optimizer.backtest(strategy, candle, params, cash=cash, **broker)
+    return optimizer.stats(result), result['_equity_curve']['Equity'], result['_trades']
+
+def allocate(issues, cash, weights=None):
+    # Cash of each issue, weights (default: equal) are normalized to sum to 1, issues missing from weights get 0
+    weights = pd.Series(1.0, index=issues) if weights is None else pd.Series(weights, dtype=float).reindex(issues).fillna(0)
+    if (weights < 0).any() or not weights.sum() > 0:
+        raise ValueError('weights should be >= 0 with a positive sum over the issues, got %s' % weights.to_dict())
+    return (weights / weights.sum() * cash).to_dict()
+
+def combine(equities, allocation):
+    '''
+    Portfolio equity curve of per-issue equity curves on the union of their dates,
+    an issue holds its allocated cash before its first bar and its last equity after its last bar.
+    '''
+    df = pd.concat(equities, axis=1, sort=True)
+    for issue in df.columns:
+        df[issue] = df[issue].ffill().fillna(allocation[issue])
+    df['Equity'] = df.sum(axis=1)
+    df['DrawdownPct'] = 1 - df['Equity'] / df['Equity'].cummax()
+    return df
+
+def summarize(curve, issue_stats, trades):
+    equity = curve['Equity']
+    pl = trades['PnL'] if len(trades) else pd.Series(dtype=float)
+    s = {
+        'Start':curve.index[0],
+        'End':curve.index[-1],
+        'Duration':curve.index[-1] - curve.index[0],
+        'Equity Final [$]':equity.iloc[-1],
+        'Equity Peak [$]':equity.max(),
+        'Return [%]':(equity.iloc[-1] - equity.iloc[0]) / equity.iloc[0] * 100,
+        'Max. Drawdown [%]':-curve['DrawdownPct'].max() * 100,
+        '# Trades':len(trades),
+        'Win Rate [%]':(pl > 0).mean() * 100 if len(pl) else np.nan,
+        '# Issues':len(issue_stats),
+        }
+    s['_equity_curve'] = curve
+    s['_issues'] = issue_stats
+    s['_trades'] = trades
+    return pd.Series(s, dtype=object)
+
+def run(strategy, candles, params, cash=1000, weights=None, processes=None, chunksize=1, **broker):
+    '''
+    Backtest strategy with params on every {issue: candle} (e.g. LocalDB.load_many()) and combine them
+    into one portfolio. cash is split across issues by weights (default: equal), each issue trades its own part.
+    Candles reach the worker processes through shared memory, processes=1 runs in the current process.
+    Returns the portfolio stats with _equity_curve (per issue and total), _issues (per-issue stats) and _trades.
+    Issues with zero weight get no cash and are not backtested.
+    '''
+    allocation = allocate(list(candles), cash, weights)
+    issues = [issue for issue in candles if allocation[issue] > 0]
+    allocation = {issue:allocation[issue] for issue in issues}
+    tasks = [(issue, allocation[issue]) for issue in issues]
+    if processes is None: processes = os.cpu_count() or 1
+    processes = min(processes, len(issues))
+    if processes <= 1:
+        results = [backtest_issue(strategy, candles[issue], params, c, **broker) for issue, c in tasks]
+    else:
+        shared = SharedCandles(candles)
+        try:
+            with ProcessPoolExecutor(max_workers=processes, initializer=_init_worker, initargs=(strategy, shared.spec, params, broker)) as pool:
+                results = list(pool.map(_run, tasks, chunksize=chunksize))
+        finally:
+            shared.close()
+            shared.unlink()
+    issue_stats = pd.DataFrame([s for s, _, _ in results], index=pd.Index(issues, name='Issue'))
+    curve = combine({issue:equity for issue, (_, equity, _) in zip(issues, results)}, allocation)
+    trades = pd.concat([t.assign(Issue=issue) for issue, (_, _, t) in zip(issues, results)], ignore_index=True)
+    return summarize(curve, issue_stats, trades)
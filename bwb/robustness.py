@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+import warnings
+import pandas as pd
+import numpy as np
+
+PERCENTILES = (5, 25, 50, 75, 95)
+METRICS = ('Equity Final [$]', 'Return [%]', 'Max. Drawdown [%]', 'Sharpe Ratio')
+# Simulations per array, bounds memory to CHUNK x trades (or bars) floats
+CHUNK = 1 << 11
+
+def trade_returns(result):
+    '''
+    Return of each trade of a Btest.run() result on the equity before it, so that compounding them
+    from the initial cash ends at cash + the PnL of every trade.
+    '''
+    trades = result['_trades']
+    pnl = trades['PnL'].to_numpy(dtype=float)
+    cash = result['_equity_curve']['Equity'].iloc[0]
+    before = cash + np.concatenate(([0.0], np.cumsum(pnl)[:-1]))
+    return pnl / before
+
+def bar_returns(result):
+    equity = result['_equity_curve']['Equity'].to_numpy(dtype=float)
+    return equity[1:] / equity[:-1] - 1
+
+def years(result):
+    index = result['_equity_curve'].index
+    days = (index[-1] - index[0]) / pd.Timedelta(days=1) if isinstance(index, pd.DatetimeIndex) else len(index)
+    return max(days / 365.25, 1e-9)
+
+# Resampling, each returns a (simulations x returns) array of returns drawn from returns
+
+def shuffle(returns, n, rng):
+    '''
+    The trades in random order: the same final equity, another path and drawdown.
+    '''
+    return rng.permuted(np.broadcast_to(returns, (n, len(returns))), axis=1)
+
+def skip(returns, n, rng, p=0.1):
+    '''
+    Every trade missed with probability p (e.g. an order not filled), its return replaced by 0.
+    '''
+    return np.where(rng.random((n, len(returns))) < p, 0.0, returns)
+
+def block_bootstrap(returns, n, rng, block=20):
+    '''
+    Circular block bootstrap: paths of len(returns) made of blocks of block consecutive returns
+    from random starts, keeping the autocorrelation within a block.
+    '''
+    m = len(returns)
+    blocks = -(-m // block)
+    starts = rng.integers(0, m, size=(n, blocks))
+    index = (starts[:, :, None] + np.arange(block)) % m
+    return returns[index.reshape(n, -1)[:, :m]]
+
+def metrics(returns, cash, per_year):
+    '''
+    METRICS of each path of returns (simulations x returns) compounded from cash.
+    Sharpe Ratio is the mean over the standard deviation of the returns, annualized with per_year returns a year.
+    '''
+    k = returns.shape[1]
+    equity = cash * np.cumprod(1 + returns, axis=1)
+    peak = np.maximum(np.maximum.accumulate(equity, axis=1), cash)
+    s1, s2 = returns.sum(axis=1), (returns * returns).sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sharpe = s1 / k / np.sqrt((s2 - s1 * s1 / k) / (k - 1)) * np.sqrt(per_year)
+    final = equity[:, -1] if returns.shape[1] else np.full(len(returns), cash)
+    return np.column_stack([
+        final,
+        (final / cash - 1) * 100,
+        ((equity / peak).min(axis=1, initial=1) - 1) * 100,
+        sharpe,
+        ])
+
+def summaries(returns, length):
+    # Of the block of length returns from each start (circular): log return, lowest and highest log equity
+    # after a bar, largest log drawdown within, sum of returns and of squared returns
+    m = len(returns)
+    ext = np.concatenate([returns] * (-(-(m + length) // m)))[:m + length - 1]
+    window = np.lib.stride_tricks.sliding_window_view(ext, length)
+    log = np.cumsum(np.log1p(window), axis=1)
+    return (log[:, -1], log.min(axis=1), log.max(axis=1), (np.maximum.accumulate(log, axis=1) - log).max(axis=1),
+        window.sum(axis=1), (window * window).sum(axis=1))
+
+def bootstrap_metrics(returns, n, rng, cash, per_year, block=20):
+    '''
+    metrics(block_bootstrap(returns, n, rng, block), cash, per_year) from per block summaries (see summaries),
+    chaining the blocks of each path instead of compounding every bar.
+    '''
+    m = len(returns)
+    blocks = -(-m // block)
+    starts = rng.integers(0, m, size=(n, blocks))
+    full, last = summaries(returns, block), summaries(returns, m - (blocks - 1) * block)
+    level, peak, drawdown, s1, s2 = np.zeros(n), np.zeros(n), np.zeros(n), np.zeros(n), np.zeros(n)
+    for b in range(blocks):
+        total, low, high, inner, r1, r2 = (v[starts[:, b]] for v in (full if b < blocks - 1 else last))
+        drawdown = np.maximum(drawdown, np.maximum(inner, peak - (level + low)))
+        peak = np.maximum(peak, level + high)
+        level = level + total
+        s1, s2 = s1 + r1, s2 + r2
+    final = cash * np.exp(level)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sharpe = s1 / m / np.sqrt((s2 - s1 * s1 / m) / (m - 1)) * np.sqrt(per_year)
+    return np.column_stack([final, (final / cash - 1) * 100, (np.exp(-drawdown) - 1) * 100, sharpe])
+
+def resampled(resample):
+    # Simulation of METHODS by compounding every path of resample
+    def simulation(returns, n, rng, cash, per_year, **kwargs):
+        return metrics(resample(returns, n, rng, **kwargs), cash, per_year)
+    return simulation
+
+METHODS = {
+    # method: (returns of a result, simulation(returns, n, rng, cash, per_year, **kwargs) -> (n x METRICS))
+    'shuffle':(trade_returns, resampled(shuffle)),
+    'skip':(trade_returns, resampled(skip)),
+    'bootstrap':(bar_returns, bootstrap_metrics),
+    }
+
+def simulate(result, method='shuffle', n=10000, seed=None, **kwargs):
+    '''
+    (n x METRICS) array of n simulations of a Btest.run() result by method of METHODS,
+    kwargs go to the resampling (p of skip, block of block_bootstrap).
+    '''
+    get_returns, simulation = METHODS[method]
+    returns = get_returns(result)
+    cash = result['_equity_curve']['Equity'].iloc[0]
+    per_year = len(returns) / years(result)
+    rng = np.random.default_rng(seed)
+    out = np.empty((n, len(METRICS)))
+    for lo in range(0, n, CHUNK):
+        out[lo:lo+CHUNK] = simulation(returns, min(CHUNK, n - lo), rng, cash, per_year, **kwargs)
+    return out
+
+def robustness(result, methods=('shuffle', 'skip', 'bootstrap'), n=10000, percentiles=PERCENTILES, seed=None, p=0.1, block=20):
+    '''
+    Percentiles of METRICS over n simulations of a Btest.run() result (or ResultStore.tables() of a run) for each of methods,
+    as a DataFrame indexed by (method, metric), with the metrics of the unresampled returns as 'Actual'.
+    p is the probability of a skipped trade, block the length of the bootstrapped blocks of bars.
+    '''
+    if 'equity_curve' in result: result = {'_equity_curve':result['equity_curve'], '_trades':result['trades']}
+    rng = np.random.default_rng(seed)
+    tables = {}
+    for method in methods:
+        sims = simulate(result, method, n, rng, **{'skip':{'p':p}, 'bootstrap':{'block':block}}.get(method, {}))
+        returns = METHODS[method][0](result)
+        actual = metrics(returns[None, :], result['_equity_curve']['Equity'].iloc[0], len(returns) / years(result))[0]
+        with warnings.catch_warnings():
+            # Sharpe Ratio of fewer than 2 trades is nan
+            warnings.simplefilter('ignore', RuntimeWarning)
+            table = np.nanpercentile(sims, percentiles, axis=0).T
+        df = pd.DataFrame(table, index=list(METRICS), columns=['P%g' % q for q in percentiles])
+        df['Actual'] = actual
+        tables[method] = df
+    return pd.concat(tables, names=['Method', 'Metric'])
+
+def from_store(store, strategy=None, issue=None, **kwargs):
+    '''
+    robustness() of every run of strategy and issue in a store.ResultStore that kept its equity curve and trades,
+    indexed by (issue, strategy, params, method, metric).
+    '''
+    runs = store.query(strategy, issue)
+    tables = {}
+    for run, row in runs.set_index('id').iterrows():
+        stored = store.tables(run)
+        if 'equity_curve' not in stored or 'trades' not in stored: continue
+        tables[(row['issue'], row['strategy'], row['params'])] = robustness(stored, **kwargs)
+    if not tables: return pd.DataFrame()
+    return pd.concat(tables, names=['Issue', 'Strategy', 'Params'])
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+import math, time
+from abc import ABCMeta, abstractmethod
+import pandas as pd
+import numpy as np
+
+try:
+    from . import indicator
+    from . import optimizer
+except:
+    import indicator
+    import optimizer
+
+class ObjectSearch(metaclass = ABCMeta):
+    '''
+    Parameter search over a base_indicator_params() style grid that backtests only part of it.
+    max_evals (backtests) and timeout (seconds) bound the search, None is unbounded.
+    After search(), report holds the number of backtests and bars used against the full grid.
+    '''
+    def __init__(self, max_evals=None, timeout=None, seed=None):
+        self.max_evals = max_evals
+        self.timeout = timeout
+        self.seed = seed
+        self.report = {}
+
+    @abstractmethod
+    def run(self, combos):
+        # Evaluate combinations with self.evaluate() until done or not self.budget_left()
+        pass
+
+    def budget_left(self):
+        if self.max_evals is not None and self.evaluations >= self.max_evals: return False
+        if self.timeout is not None and time.monotonic() - self.started >= self.timeout: return False
+        return True
+
+    def evaluate(self, params, bars=None):
+        '''
+        Backtest params on the first bars of the candle (default: all) and return the score, higher is better.
+        '''
+        bars = len(self.candle) if bars is None else min(bars, len(self.candle))
+        result = optimizer.stats(optimizer.backtest(self.strategy, self.candle.iloc[:bars], params, **self.broker))
+        self.evaluations += 1
+        self.bars += bars
+        row = dict(params)
+        row.update(result)
+        row['Bars'] = bars
+        self.history.append(row)
+        value = result[self.metric]
+        if value is None or np.isnan(value): return -np.inf
+        return value if self.maximize else -value
+
+    def search(self, strategy, candle, params=None, metric=optimizer.METRIC, maximize=True, **broker):
+        '''
+        Search params (default: strategy.base_indicator_params()) and return a DataFrame of params and stats
+        of every evaluated combination at its longest evaluation, ranked by Bars then metric as optimizer.optimize.
+        '''
+        combos = optimizer.grid(strategy.base_indicator_params() if params is None else params)
+        self.strategy, self.candle, self.metric, self.maximize, self.broker = strategy, candle, metric, maximize, broker
+        self.evaluations, self.bars, self.history = 0, 0, []
+        self.started = time.monotonic()
+        # Prefixes of candle share the indicators computed on the whole candle
+        with indicator.cache.sliced(candle):
+            self.run(combos)
+        df = pd.DataFrame(self.history)
+        if len(df):
+            df = df.drop_duplicates(subset=list(combos[0]), keep='last')
+            df = df.sort_values(['Bars', metric], ascending=[False, not maximize], na_position='last', kind='stable').reset_index(drop=True)
+        self.report = {
+            'grid':len(combos),
+            'evaluations':self.evaluations,
+            # In full-candle backtests, evaluations on prefixes count by their share of the bars
+            'backtests saved':len(combos) - self.bars / len(candle),
+            'bars saved [%]':(1 - self.bars / (len(combos) * len(candle))) * 100,
+            'seconds':time.monotonic() - self.started,
+            }
+        return df
+
+
+class SuccessiveHalving(ObjectSearch):
+    '''
+    Every combination is backtested on a short prefix of the candle, the best 1/eta of them
+    on a prefix eta times longer, and so on up to the whole candle.
+    The first prefix is len(candle) / eta**rungs bars (at least min_bars), rungs = log_eta(#combinations).
+    '''
+    def __init__(self, eta=3, min_bars=100, **kwargs):
+        super().__init__(**kwargs)
+        self.eta = eta
+        self.min_bars = min_bars
+
+    def run(self, combos):
+        n = len(self.candle)
+        rungs = int(math.log(len(combos), self.eta)) if len(combos) > 1 else 0
+        bars = min(max(n // self.eta**rungs, self.min_bars), n)
+        candidates = combos
+        while True:
+            scores = []
+            for params in candidates:
+                if not self.budget_left(): return
+                scores.append(self.evaluate(params, bars))
+            if bars >= n or len(candidates) == 1: return
+            order = np.argsort(-np.array(scores), kind='stable')
+            candidates = [candidates[i] for i in order[:max(len(candidates) // self.eta, 1)]]
+            bars = min(bars * self.eta, n)
+
+
+class TPE(ObjectSearch):
+    '''
+    Tree-structured Parzen Estimator over the grid. After n_startup random combinations, the evaluated ones
+    are split into the best gamma and the rest, and the next combination is the one among n_candidates drawn from
+    the density of the best that maximizes density(best) / density(rest). Each parameter's density is a
+    Gaussian kernel over the positions of its values, so neighbouring values share evidence.
+    Stops after max_evals (default: a quarter of the grid) or when every combination is evaluated.
+    '''
+    def __init__(self, n_startup=10, gamma=0.25, n_candidates=24, bandwidth=1.0, **kwargs):
+        super().__init__(**kwargs)
+        self.n_startup = n_startup
+        self.gamma = gamma
+        self.n_candidates = n_candidates
+        self.bandwidth = bandwidth
+
+    def density(self, positions, observed, size):
+        # Per parameter: (prior + kernels around observed positions), normalized over its values
+        grid = np.arange(size)
+        weights = 1.0 + np.exp(-0.5 * ((grid[:, None] - observed[None, :]) / self.bandwidth) ** 2).sum(axis=1)
+        return (weights / weights.sum())[positions]
+
+    def run(self, combos):
+        rng = np.random.default_rng(self.seed)
+        limit = max(self.n_startup, len(combos) // 4) if self.max_evals is None else self.max_evals
+        keys = list(combos[0])
+        values = [list(dict.fromkeys(c[k] for c in combos)) for k in keys]
+        positions = np.array([[v.index(c[k]) for k, v in zip(keys, values)] for c in combos])
+        remaining = np.ones(len(combos), dtype=bool)
+        evaluated, scores = [], []
+        while remaining.any() and self.evaluations < limit and self.budget_left():
+            if len(evaluated) < self.n_startup:
+                i = rng.choice(np.flatnonzero(remaining))
+            else:
+                order = np.argsort(-np.array(scores), kind='stable')
+                n_good = max(1, int(math.ceil(self.gamma * len(scores))))
+                good, bad = [evaluated[j] for j in order[:n_good]], [evaluated[j] for j in order[n_good:]]
+                candidates = np.flatnonzero(remaining)
+                l, g = np.ones(len(candidates)), np.ones(len(candidates))
+                for k in range(len(keys)):
+                    l *= self.density(positions[candidates, k], positions[good, k], len(values[k]))
+                    g *= self.density(positions[candidates, k], positions[bad, k], len(values[k]))
+                drawn = rng.choice(len(candidates), size=min(self.n_candidates, len(candidates)), replace=False, p=l / l.sum())
+                i = candidates[drawn[np.argmax(l[drawn] / g[drawn])]]
+            remaining[i] = False
+            evaluated.append(i)
+            scores.append(self.evaluate(combos[i]))
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+import os, threading, time
+import pandas as pd
+from datetime import timedelta as td
+from abc import ABCMeta, abstractmethod
+
+def in_period(df, start, end):
+    # Days start+1 .. end-1, the period convention of LocalDB
+    days = df.index.date
+    return df[(days > start) & (days < end)]
+
+class ObjectSource(metaclass = ABCMeta):
+    '''
+    Source of candles for LocalDB.
+    rate is the maximum number of fetch() calls per second shared by all threads (None: unlimited),
+    failed fetches are retried retries times, waiting backoff * 2**attempt seconds.
+    '''
+    rate = None
+    retries = 0
+    backoff = 1.0
+
+    def __init__(self, rate=None, retries=None, backoff=None):
+        if rate is not None: self.rate = rate
+        if retries is not None: self.retries = retries
+        if backoff is not None: self.backoff = backoff
+        self.__lock = threading.Lock()
+        self.__next = 0.0
+
+    @abstractmethod
+    def fetch(self, issue, start, end):
+        pass
+
+    def wait(self):
+        if not self.rate: return
+        with self.__lock:
+            now = time.monotonic()
+            at = max(now, self.__next)
+            self.__next = at + 1 / self.rate
+        time.sleep(at - now)
+
+    def get(self, issue, start, end):
+        for attempt in range(self.retries + 1):
+            self.wait()
+            try:
+                return self.fetch(issue, start, end)
+            except Exception:
+                if attempt == self.retries: raise
+                time.sleep(self.backoff * 2**attempt)
+
+
+class YFinanceSource(ObjectSource):
+    rate = 2
+    retries = 3
+
+    def fetch(self, issue, start, end):
+        '''
+        standard output
+            $start:(input 0714, output 0713), $end :(input 0721, output 0720)
+        $start is to +1, $end is to stay the same.
+        In Japan, the US market starts at night and ends in the morning.
+        Therefore, it is better to get the stock price one day before Japan time (=end) while the US market is closed.
+        '''
+        # Imported here, only fetching from Yahoo needs them
+        import pandas_datareader.data as web
+        import yfinance as yf
+        yf.pdr_override()
+        return web.get_data_yahoo(issue, data_source='yahoo', start=start+td(days=1), end=end)
+
+
+class FileSource(ObjectSource):
+    '''
+    Offline source reading <root>/<issue>.csv, e.g. a LocalDB candle.csv exported elsewhere.
+    '''
+    def __init__(self, root=None, **kwargs):
+        if root is None: raise ValueError("the file source needs root, e.g. get_source('file', root='csv/')")
+        super().__init__(**kwargs)
+        self.root = root
+
+    def fetch(self, issue, start, end):
+        df = pd.read_csv(os.path.join(self.root, issue + '.csv'), index_col=0)
+        df.index = pd.to_datetime(df.index, format='ISO8601')
+        return in_period(df, start, end)
+
+
+class FrameSource(ObjectSource):
+    '''
+    In-memory source of {issue: DataFrame}, for tests and stubs.
+    '''
+    def __init__(self, frames, **kwargs):
+        super().__init__(**kwargs)
+        self.frames = frames
+
+    def fetch(self, issue, start, end):
+        return in_period(self.frames[issue], start, end)
+
+
+SOURCES = {
+    'yfinance':YFinanceSource,
+    'file':FileSource,
+    'frame':FrameSource,
+    }
+
+def register_source(name, cls):
+    SOURCES[name] = cls
+
+def get_source(source, **kwargs):
+    # source is a registered name or an ObjectSource
+    if isinstance(source, ObjectSource): return source
+    return SOURCES[source](**kwargs)
@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+import datetime, json, pickle, re, sqlite3, threading, zlib
+import pandas as pd
+import numpy as np
+
+# Columns identifying a run, period_start and period_end are the first and last bar of the candle (the stats Start and End)
+KEYS = ('issue', 'period_start', 'period_end', 'strategy', 'params', 'broker')
+# Columns of runs besides KEYS and the stats, period is the requested start .. end of the job (see period_id)
+META = ('id', 'created', 'period')
+
+def column_name(stat):
+    '''
+    SQL column of a stat of Btest.run(), e.g. 'Sharpe Ratio' -> sharpe_ratio, 'Return [%]' -> return_pct.
+    '''
+    name = stat.lower().replace('[%]', 'pct').replace('[$]', 'usd').replace('#', 'n').replace('.', '')
+    return re.sub(r'[^0-9a-z]+', '_', name).strip('_')
+
+def to_sql(v):
+    # Timestamps as ISO text, durations as days
+    if isinstance(v, (np.generic,)): v = v.item()
+    if isinstance(v, (pd.Timestamp, datetime.datetime, datetime.date)): return v.isoformat()
+    if isinstance(v, (pd.Timedelta, datetime.timedelta)): return pd.Timedelta(v).total_seconds() / 86400
+    if isinstance(v, float) and np.isnan(v): return None
+    return v
+
+def period_id(start, end):
+    '''
+    Requested period of a run as text, e.g. '2020-01-01T00:00:00/2020-12-31T00:00:00' for dates, strings or Timestamps,
+    so issues with different first and last bars of the same job share it.
+    '''
+    return '/'.join(pd.Timestamp(v).isoformat() for v in (start, end))
+
+def dumps(v):
+    return json.dumps(v, sort_keys=True, default=to_sql)
+
+def pack(df):
+    return zlib.compress(pickle.dumps(df, protocol=pickle.HIGHEST_PROTOCOL))
+
+def unpack(blob):
+    return pickle.loads(zlib.decompress(blob))
+
+
+class ResultStore:
+    '''
+    Backtest results in one SQLite file: a runs row per (issue, period, strategy, params, broker)
+    with every scalar stat as a column (see column_name), the stats, equity curve and trades compressed in tables.
+    Storing the same run again replaces it. Each run is committed on its own, so the store is also the journal
+    of a long job (see journal and optimizer.optimize(store=...)), readable by other processes while it runs.
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.con = sqlite3.connect(path, check_same_thread=False)
+        self.__lock = threading.Lock()
+        self.con.execute('PRAGMA foreign_keys=ON')
+        with self.__lock, self.con:
+            self.con.execute('PRAGMA journal_mode=WAL')
+            self.con.execute('''CREATE TABLE IF NOT EXISTS runs (
+                id INTEGER PRIMARY KEY, issue TEXT, period_start TEXT, period_end TEXT, strategy TEXT, params TEXT, broker TEXT,
+                created TEXT, period TEXT, UNIQUE (issue, period_start, period_end, strategy, params, broker))''')
+            if 'period' not in [row[1] for row in self.con.execute('PRAGMA table_info(runs)')]:
+                # Stores older than period, their runs are grouped by their own bars as before
+                self.con.execute('ALTER TABLE runs ADD COLUMN period TEXT')
+                self.con.execute("UPDATE runs SET period = period_start || '/' || period_end")
+            self.con.execute('CREATE INDEX IF NOT EXISTS runs_strategy ON runs (strategy, issue)')
+            self.con.execute('CREATE INDEX IF NOT EXISTS runs_issue ON runs (issue)')
+            self.con.execute('''CREATE TABLE IF NOT EXISTS tables (
+                run INTEGER REFERENCES runs (id) ON DELETE CASCADE, name TEXT, data BLOB, PRIMARY KEY (run, name))''')
+        self.columns = self.stat_columns()
+
+    def stat_columns(self):
+        return [row[1] for row in self.con.execute('PRAGMA table_info(runs)') if row[1] not in KEYS + META]
+
+    def metric_column(self, metric):
+        # Column of metric, SQLite would read an unknown quoted name as a string and sort by nothing
+        column = column_name(metric)
+        if column not in self.columns:
+            with self.__lock:
+                self.columns = self.stat_columns()
+            if column not in self.columns: raise ValueError('unknown metric %r, the stats are %s' % (metric, ', '.join(self.columns)))
+        return column
+
+    def close(self):
+        self.con.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def put(self, result, issue, start, end, strategy, params=None, broker=None, period=None):
+        '''
+        Store Btest.run() result of strategy (class or name) with params on issue for the period (start, end),
+        the first and last bar of the backtested candle. period is the (start, end) requested for the job,
+        top() aggregates issues by it (default: start, end). Returns the id of the run.
+        '''
+        strategy = strategy if isinstance(strategy, str) else strategy.__name__
+        stats = {column_name(k):to_sql(v) for k, v in result.items() if not k.startswith('_')}
+        keys = (issue, str(start), str(end), strategy, dumps(params or {}), dumps(broker or {}))
+        period = period_id(*(period or (start, end)))
+        with self.__lock, self.con:
+            if not set(stats) <= set(self.columns):
+                # Another process may have added them since
+                self.columns = self.stat_columns()
+            for column in stats:
+                if column not in self.columns:
+                    try:
+                        self.con.execute('ALTER TABLE runs ADD COLUMN "%s"' % column)
+                    except sqlite3.OperationalError as e:
+                        if 'duplicate column name' not in str(e): raise
+                    self.columns.append(column)
+            self.con.execute('DELETE FROM runs WHERE issue=? AND period_start=? AND period_end=? AND strategy=? AND params=? AND broker=?', keys)
+            names = list(KEYS) + ['created', 'period'] + list(stats)
+            cursor = self.con.execute('INSERT INTO runs (%s) VALUES (%s)' % (', '.join('"%s"' % n for n in names), ', '.join('?' * len(names))),
+                keys + (datetime.datetime.now().isoformat(timespec='seconds'), period) + tuple(stats.values()))
+            run = cursor.lastrowid
+            # The stats as received, their column names and types in runs are lossy
+            stats = pd.Series({k:v for k, v in result.items() if not k.startswith('_')}, dtype=object)
+            self.con.execute('INSERT INTO tables VALUES (?, ?, ?)', (run, 'stats', pack(stats)))
+            for name in ('_equity_curve', '_trades'):
+                if name in result:
+                    self.con.execute('INSERT INTO tables VALUES (?, ?, ?)', (run, name.strip('_'), pack(result[name])))
+        return run
+
+    def journal(self, issue, start, end, strategy, broker=None):
+        '''
+        {params (json, see dumps): run id} of the runs of strategy on issue for the period (start, end) with broker.
+        Runs stored without their stats are left out, so a resumed job runs them again.
+        '''
+        strategy = strategy if isinstance(strategy, str) else strategy.__name__
+        sql = ("SELECT params, id FROM runs JOIN tables ON tables.run=runs.id AND tables.name='stats'"
+            ' WHERE issue=? AND period_start=? AND period_end=? AND strategy=? AND broker=?')
+        with self.__lock:
+            rows = self.con.execute(sql, (issue, str(start), str(end), strategy, dumps(broker or {}))).fetchall()
+        return dict(rows)
+
+    def stats(self, runs):
+        '''
+        Stats Series of each of runs (ids) as put() received them.
+        '''
+        runs, found = list(runs), {}
+        with self.__lock:
+            # Below SQLite's limit of variables per statement
+            for lo in range(0, len(runs), 500):
+                part = runs[lo:lo+500]
+                sql = "SELECT run, data FROM tables WHERE name='stats' AND run IN (%s)" % ', '.join('?' * len(part))
+                found.update(self.con.execute(sql, part).fetchall())
+        return [unpack(found[run]) for run in runs]
+
+    def tables(self, run):
+        '''
+        {'stats': Series, 'equity_curve': DataFrame, 'trades': DataFrame} of a run.
+        '''
+        with self.__lock:
+            rows = self.con.execute('SELECT name, data FROM tables WHERE run=?', (run,)).fetchall()
+        return {name:unpack(data) for name, data in rows}
+
+    def select(self, sql, args=()):
+        with self.__lock:
+            cursor = self.con.execute(sql, args)
+            columns = [d[0] for d in cursor.description]
+            return pd.DataFrame(cursor.fetchall(), columns=columns)
+
+    @staticmethod
+    def where(strategy=None, issue=None):
+        conditions, args = [], []
+        for key, value in (('strategy', strategy), ('issue', issue)):
+            if value is None: continue
+            values = [value] if isinstance(value, str) else list(value)
+            conditions.append('%s IN (%s)' % (key, ', '.join('?' * len(values))))
+            args += values
+        return (' WHERE ' + ' AND '.join(conditions) if conditions else ''), args
+
+    def query(self, strategy=None, issue=None, metric=None, maximize=True, limit=None):
+        '''
+        Runs of strategy and issue (a name, a list of names or None for all), best first by metric.
+        '''
+        where, args = self.where(strategy, issue)
+        sql = 'SELECT * FROM runs' + where
+        if metric:
+            column = self.metric_column(metric)
+            sql += ' ORDER BY "%s" IS NULL, "%s" %s' % (column, column, 'DESC' if maximize else 'ASC')
+        if limit: sql += ' LIMIT %d' % limit
+        return self.select(sql, args)
+
+    def top(self, strategy, metric='Sharpe Ratio', n=20, maximize=True, issue=None, agg='avg'):
+        '''
+        The n best params of strategy by metric aggregated (avg, min, max or sum) across issues,
+        e.g. top('RCICross', 'Sharpe Ratio', 20). Runs of other requested periods (see put) or brokers are not
+        aggregated together, each (params, period, broker) is a row. params are expanded to columns.
+        '''
+        if agg not in ('avg', 'min', 'max', 'sum'): raise ValueError('agg must be one of avg, min, max, sum')
+        column = self.metric_column(metric)
+        where, args = self.where(strategy, issue)
+        df = self.select('SELECT params, period, broker, %s("%s") AS value, COUNT(*) AS issues FROM runs%s'
+            ' GROUP BY params, period, broker ORDER BY value IS NULL, value %s LIMIT %d'
+            % (agg, column, where, 'DESC' if maximize else 'ASC', n), args)
+        params = pd.DataFrame([json.loads(p) for p in df.pop('params')], index=df.index)
+        return pd.concat([params, df.rename(columns={'value':column})], axis=1)
@@ -0,0 +1,405 @@
+# -*- coding: utf-8 -*-
+import math
+from collections import deque
+import numpy as np
+
+NaN = float('nan')
+
+def isnan(v):
+    return v != v
+
+def divide(a, b):
+    # float division with numpy semantics (x/0 -> ±inf or nan), as the Series arithmetic of indicator
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return float(np.float64(a) / np.float64(b))
+
+def replay(stream, candle):
+    '''
+    Feed every bar of candle to stream and return its outputs as an array (one row per output).
+    '''
+    values = [stream.update(bar) for _, bar in candle.iterrows()]
+    return np.array(values, dtype=float).T
+
+# Rolling kernels, the online algorithms of pandas' rolling(window) aggregations
+# (pandas/_libs/window/aggregations.pyx) applied one value at a time, so results are bit-identical.
+
+class _RollingSum:
+    def __init__(self, window):
+        self.window = window
+        self.buffer = deque(maxlen=window)
+
+    def reset(self):
+        self.sum = self.compensation_add = self.compensation_remove = 0.0
+        self.nobs = 0
+        self.prev = self.buffer[0]
+        self.same = 0
+
+    def add(self, val):
+        if isnan(val): return
+        self.nobs += 1
+        y = val - self.compensation_add
+        t = self.sum + y
+        self.compensation_add = t - self.sum - y
+        self.sum = t
+        self.same = self.same + 1 if val == self.prev else 1
+        self.prev = val
+
+    def remove(self, val):
+        if isnan(val): return
+        self.nobs -= 1
+        y = - val - self.compensation_remove
+        t = self.sum + y
+        self.compensation_remove = t - self.sum - y
+        self.sum = t
+
+    def push(self, val):
+        old = self.buffer[0] if len(self.buffer) == self.window else None
+        self.buffer.append(val)
+        # pandas restarts when consecutive windows do not overlap
+        if len(self.buffer) == 1 or self.window == 1:
+            self.reset()
+        elif old is not None:
+            self.remove(old)
+        self.add(val)
+
+    def update(self, val):
+        self.push(val)
+        if self.nobs >= self.window:
+            return self.prev * self.nobs if self.same >= self.nobs else self.sum
+        return NaN
+
+
+class _RollingMean(_RollingSum):
+    def reset(self):
+        super().reset()
+        self.neg = 0
+
+    def add(self, val):
+        if not isnan(val) and math.copysign(1, val) < 0: self.neg += 1
+        super().add(val)
+
+    def remove(self, val):
+        if not isnan(val) and math.copysign(1, val) < 0: self.neg -= 1
+        super().remove(val)
+
+    def update(self, val):
+        self.push(val)
+        if self.nobs >= self.window and self.nobs > 0:
+            result = self.sum / self.nobs
+            if self.same >= self.nobs: result = self.prev
+            elif self.neg == 0 and result < 0: result = 0.0
+            elif self.neg == self.nobs and result > 0: result = 0.0
+            return result
+        return NaN
+
+
+class _RollingVar:
+    # Welford's method with Kahan summation, recomputed from the window on catastrophic cancellation
+    InvCondTol = np.finfo(np.float64).eps * 1e3
+
+    def __init__(self, window, ddof=1):
+        self.window, self.ddof = window, ddof
+        self.buffer = deque(maxlen=window)
+
+    def add(self, val):
+        if isnan(val): return
+        prev_m2 = self.ssqdm
+        self.nobs += 1
+        prev_mean = self.mean - self.compensation_add
+        y = val - self.compensation_add
+        t = y - self.mean
+        self.compensation_add = t + self.mean - y
+        self.mean = self.mean + t / self.nobs
+        self.ssqdm = self.ssqdm + (val - prev_mean) * (val - self.mean)
+        if prev_m2 * self.InvCondTol > self.ssqdm: self.unstable = True
+
+    def remove(self, val):
+        if isnan(val): return
+        prev_m2 = self.ssqdm
+        self.nobs -= 1
+        if self.nobs:
+            prev_mean = self.mean - self.compensation_remove
+            y = val - self.compensation_remove
+            t = y - self.mean
+            self.compensation_remove = t + self.mean - y
+            self.mean = self.mean - t / self.nobs
+            self.ssqdm = self.ssqdm - (val - prev_mean) * (val - self.mean)
+            if prev_m2 * self.InvCondTol > self.ssqdm: self.unstable = True
+        else:
+            self.mean = self.ssqdm = 0.0
+            self.unstable = False
+
+    def update(self, val):
+        old = self.buffer[0] if len(self.buffer) == self.window else None
+        self.buffer.append(val)
+        recompute = len(self.buffer) == 1 or self.window == 1
+        if not recompute:
+            if old is not None: self.remove(old)
+            self.add(val)
+        if recompute or self.unstable:
+            self.mean = self.ssqdm = self.compensation_add = self.compensation_remove = 0.0
+            self.nobs = 0
+            self.unstable = False
+            for v in self.buffer:
+                self.add(v)
+            self.unstable = False
+        if self.nobs >= max(self.window, 1) and self.nobs > self.ddof:
+            return self.ssqdm / (self.nobs - self.ddof)
+        return NaN
+
+
+class _RollingExtreme:
+    # Rolling max (sign=1) or min (sign=-1) over non-NaN values with a monotonic deque
+    def __init__(self, window, sign=1):
+        self.window, self.sign = window, sign
+        self.i = 0
+        # NaN flags of the window and their running count
+        self.nans = deque(maxlen=window)
+        self.nan_count = 0
+        self.candidates = deque()
+
+    def update(self, val):
+        if len(self.nans) == self.window: self.nan_count -= self.nans[0]
+        self.nans.append(isnan(val))
+        self.nan_count += self.nans[-1]
+        if not isnan(val):
+            while self.candidates and self.candidates[-1][1] * self.sign <= val * self.sign:
+                self.candidates.pop()
+            self.candidates.append((self.i, val))
+        while self.candidates and self.candidates[0][0] <= self.i - self.window:
+            self.candidates.popleft()
+        self.i += 1
+        if len(self.nans) - self.nan_count >= self.window:
+            return self.candidates[0][1]
+        return NaN
+
+
+class _EWM:
+    # ewm(span).mean() with adjust=True, pandas' ewm kernel
+    def __init__(self, span):
+        com = float((span - 1) / 2)
+        self.old_wt_factor = 1. - 1. / (1. + com)
+        self.weighted = None
+
+    def update(self, cur):
+        if self.weighted is None:
+            self.weighted, self.old_wt = cur, 1.
+            self.nobs = int(not isnan(cur))
+        else:
+            self.nobs += not isnan(cur)
+            if not isnan(self.weighted):
+                self.old_wt *= self.old_wt_factor
+                if not isnan(cur):
+                    if self.weighted != cur:
+                        self.weighted = self.old_wt * self.weighted + 1. * cur
+                        self.weighted /= (self.old_wt + 1.)
+                    self.old_wt += 1.
+            elif not isnan(cur):
+                self.weighted = cur
+        return self.weighted if self.nobs >= 1 else NaN
+
+
+class _Previous:
+    # Value of the previous bar, shift(1)
+    def __init__(self):
+        self.value = NaN
+
+    def update(self, val):
+        prev, self.value = self.value, val
+        return prev
+
+# Streaming counterparts of bwb.indicator, update(bar) takes one OHLCV bar (dict or row Series)
+# and returns the same value(s) the batch function returns for that bar.
+
+class SMAStream:
+    def __init__(self, day=5):
+        self.mean = _RollingMean(day)
+
+    def update(self, bar):
+        return self.mean.update(bar['Close'])
+
+
+class SigmaStream:
+    def __init__(self, day=5):
+        self.var = _RollingVar(day)
+
+    def update(self, bar):
+        var = self.var.update(bar['Close'])
+        return 0.0 if var < 0 else math.sqrt(var) if not isnan(var) else NaN
+
+
+class EMAStream:
+    def __init__(self, day=5):
+        self.ewm = _EWM(day)
+
+    def update(self, bar):
+        return self.ewm.update(bar['Close'])
+
+
+class MACDStream:
+    def __init__(self, day_short=12, day_long=26, span=9):
+        self.short, self.long, self.signal = _EWM(day_short), _EWM(day_long), _EWM(span)
+
+    def update(self, bar):
+        macd = self.short.update(bar['Close']) - self.long.update(bar['Close'])
+        return macd, self.signal.update(macd)
+
+
+class CIStream:
+    def __init__(self, day=20, upper_sigma=2, lower_sigma=2):
+        self.sma, self.sigma = SMAStream(day), SigmaStream(day)
+        self.upper_sigma, self.lower_sigma = upper_sigma, lower_sigma
+
+    def update(self, bar):
+        sma, sigma = self.sma.update(bar), self.sigma.update(bar)
+        return sma + sigma * self.upper_sigma, sma - sigma * self.lower_sigma
+
+
+class TRStream:
+    def __init__(self):
+        self.close = _Previous()
+
+    def update(self, bar):
+        prev = self.close.update(bar['Close'])
+        values = [abs(bar['High'] - bar['Low']), abs(bar['High'] - prev), abs(bar['Low'] - prev)]
+        values = [v for v in values if not isnan(v)]
+        return max(values) if values else NaN
+
+
+class DIStream:
+    def __init__(self, span=14):
+        self.high, self.low, self.tr = _Previous(), _Previous(), TRStream()
+        self.dm_p, self.dm_m, self.tr_sum = _RollingSum(span), _RollingSum(span), _RollingSum(span)
+
+    def update(self, bar):
+        dm_p = bar['High'] - self.high.update(bar['High'])
+        dm_m = self.low.update(bar['Low']) - bar['Low']
+        if dm_p < 0: dm_p = 0.0
+        if dm_m < 0: dm_m = 0.0
+        if dm_p - dm_m <= 0: dm_p = 0.0
+        if dm_p - dm_m >= 0: dm_m = 0.0
+        tr = self.tr_sum.update(self.tr.update(bar))
+        return divide(self.dm_p.update(dm_p), tr) * 100, divide(self.dm_m.update(dm_m), tr) * 100
+
+
+class ADXStream:
+    def __init__(self, span=14):
+        self.di, self.dx = DIStream(span), _RollingMean(span)
+
+    def update(self, bar):
+        di_p, di_m = self.di.update(bar)
+        return self.dx.update(divide(abs(di_p - di_m), di_p + di_m) * 100)
+
+
+class SARStream:
+    # indicator.sar() one bar at a time, returns psar, psarbear, psarbull
+    def __init__(self, iaf=0.02, maxaf=0.2):
+        self.iaf, self.maxaf = iaf, maxaf
+        self.high, self.low = deque(maxlen=3), deque(maxlen=3)
+        self.psar = None
+
+    def update(self, bar):
+        high, low = self.high, self.low
+        high.append(bar['High'])
+        low.append(bar['Low'])
+        if self.psar is None:
+            self.bull, self.af, self.hp, self.lp = True, self.iaf, bar['High'], bar['Low']
+        if len(high) < 3:
+            self.psar = bar['Close']
+            return self.psar, NaN, NaN
+        psar = self.psar + self.af * ((self.hp if self.bull else self.lp) - self.psar)
+        reverse = False
+        if self.bull:
+            if low[2] < psar:
+                self.bull, reverse = False, True
+                psar, self.lp, self.af = self.hp, low[2], self.iaf
+        else:
+            if high[2] > psar:
+                self.bull, reverse = True, True
+                psar, self.hp, self.af = self.lp, high[2], self.iaf
+        if not reverse:
+            if self.bull:
+                if high[2] > self.hp:
+                    self.hp = high[2]
+                    self.af = min(self.af + self.iaf, self.maxaf)
+                if low[1] < psar: psar = low[1]
+                if low[0] < psar: psar = low[0]
+            else:
+                if low[2] < self.lp:
+                    self.lp = low[2]
+                    self.af = min(self.af + self.iaf, self.maxaf)
+                if high[1] > psar: psar = high[1]
+                if high[0] > psar: psar = high[0]
+        self.psar = psar
+        return (psar, NaN, psar) if self.bull else (psar, psar, NaN)
+
+
+class RSIStream:
+    def __init__(self, span=14):
+        self.close, self.up, self.down = _Previous(), _RollingSum(span), _RollingSum(span)
+
+    def update(self, bar):
+        diff = bar['Close'] - self.close.update(bar['Close'])
+        up, down = diff, diff
+        if up <= 0: up = 0.0
+        if down > 0: down = 0.0
+        return 100 - divide(100, 1.0 + divide(abs(self.up.update(up)), abs(self.down.update(down))))
+
+
+class StochStream:
+    # Slow Stochastics as indicator.slow_s, or Fast Stochastics as indicator.fast_s with slow=False
+    def __init__(self, maxmin_span=9, k_span=3, slow=True):
+        self.slow = slow
+        self.low_min, self.high_max = _RollingExtreme(maxmin_span, -1), _RollingExtreme(maxmin_span, 1)
+        self.fast_d, self.slow_d = _RollingMean(k_span), _RollingMean(k_span)
+
+    def update(self, bar):
+        low_min, high_max = self.low_min.update(bar['Low']), self.high_max.update(bar['High'])
+        fast_k = divide(100 * (bar['Close'] - low_min), high_max - low_min)
+        fast_d = self.fast_d.update(fast_k)
+        if not self.slow: return fast_k, fast_d
+        return fast_d, self.slow_d.update(fast_d)
+
+
+class PsycoStream:
+    def __init__(self, span=12):
+        self.span = span
+        self.close, self.win = _Previous(), _RollingSum(span)
+
+    def update(self, bar):
+        close = self.close.update(bar['Close'])
+        # Like indicator.psyco, the first bar has no previous close and keeps its Close
+        win = bar['Close']
+        if bar['Close'] - close > 0: win = 1.0
+        if bar['Close'] - close <= 0: win = 0.0
+        return self.win.update(win) / self.span * 100
+
+
+class RCIStream:
+    # O(span log span) per bar over a ring buffer of the last span closes, ranks as indicator._rci:
+    # equal prices share the rank of the last of their run in ascending order, NaN sorts last and is its own run
+    def __init__(self, span=9):
+        self.span = span
+        self.buffer = deque(maxlen=span)
+
+    def update(self, bar):
+        self.buffer.append(bar['Close'])
+        span = self.span
+        if len(self.buffer) < span: return NaN
+        values = list(self.buffer)
+        order = sorted(range(span), key=lambda j: (isnan(values[j]), values[j]))
+        rank, last = [0] * span, span - 1
+        for pos in range(span - 1, -1, -1):
+            if pos == span - 1 or values[order[pos + 1]] != values[order[pos]]: last = pos
+            rank[order[pos]] = span - last
+        d = sum((span - i - rank[i]) ** 2 for i in range(span))
+        return (1 - 6*d / (span * (span*span - 1))) * 100
+
+
+class MAERStream:
+    def __init__(self, span=25):
+        self.sma = SMAStream(span)
+
+    def update(self, bar):
+        sma = self.sma.update(bar)
+        return (bar['Close'] - sma) / sma * 100 if not isnan(sma) else NaN
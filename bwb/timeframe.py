@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+import pandas as pd
+import numpy as np
+
+# Aggregation of each candle column into a bar of a higher timeframe
+AGG = {'Open':'first', 'High':'max', 'Low':'min', 'Close':'last', 'Adj Close':'last', 'Volume':'sum'}
+# Calendar rules, weeks end on Friday
+PERIODS = {'W':'W-FRI', 'M':'M'}
+
+def groups(index, rule):
+    '''
+    Bar number of each row for rule: 'W' (weeks), 'M' (months) or 'ND' (runs of N rows from the first one).
+    '''
+    if rule.endswith('D') and rule[:-1].isdigit():
+        return np.arange(len(index)) // int(rule[:-1])
+    if rule not in PERIODS: raise ValueError("rule must be 'W', 'M' or 'ND' (e.g. '3D')")
+    return pd.factorize(index.to_period(PERIODS[rule]))[0]
+
+def resample(df, rule):
+    '''
+    OHLCV bars of rule, each indexed by the time of its last row, i.e. when the bar is complete.
+    '''
+    codes = groups(df.index, rule)
+    last = np.r_[np.flatnonzero(np.diff(codes)), len(codes) - 1] if len(codes) else np.array([], dtype=int)
+    bars = df.groupby(codes, sort=False).agg({c:AGG[c] for c in df.columns if c in AGG})
+    bars.index = df.index[last]
+    return bars
+
+def extend(bars, df, rule):
+    '''
+    bars (resample(df[:k], rule)) updated with the rows df gained after it. Only the last bar
+    of bars can be incomplete, so it is rebuilt from the rows after the bar before it.
+    '''
+    if len(bars) < 2: return resample(df, rule)
+    return pd.concat([bars.iloc[:-1], resample(df[df.index > bars.index[-2]], rule)])
+
+def align(values, bars_index, index):
+    '''
+    Values on bars_index (bars of resample()) on each row of index, the last bar complete at or before it.
+    Rows before the first complete bar are nan, so no row sees a bar before the bar ends.
+    '''
+    if isinstance(values, tuple): return tuple(align(v, bars_index, index) for v in values)
+    values = np.asarray(values, dtype=float)
+    pos = bars_index.searchsorted(index, side='right') - 1
+    aligned = values[..., np.maximum(pos, 0)]
+    aligned[..., pos < 0] = np.nan
+    return pd.Series(aligned, index=index) if aligned.ndim == 1 else aligned
+
+def higher(func, data, rule, *args, **kwargs):
+    '''
+    Indicator func(bars, *args, **kwargs) of data resampled to rule, aligned back to data's rows.
+    For multi-timeframe filters in init(), e.g. self.I(timeframe.higher, indicator.sma, self.data, 'W', 10).
+    The last bar of data may be one still running (e.g. a week ending after data), it counts as complete.
+    '''
+    # backtesting's _Data or a DataFrame
+    df = data.df if hasattr(data, 'df') else data
+    bars = resample(df, rule)
+    return align(func(bars, *args, **kwargs), bars.index, df.index)
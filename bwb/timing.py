@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+import contextlib, cProfile, pstats, threading, time
+import pandas as pd
+
+class Span:
+    def __init__(self, timer, name, info):
+        self.timer, self.name, self.info = timer, name, info
+
+    def __enter__(self):
+        stack = self.timer.stack()
+        stack.append(self.name)
+        self.phase = '/'.join(stack)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        seconds = time.perf_counter() - self.start
+        self.timer.stack().pop()
+        self.timer.record(dict(name=self.name, phase=self.phase, seconds=seconds, **self.info))
+        return False
+
+
+class Collection:
+    '''
+    Records of the spans of one collect() block, from its thread and the calls bound to it by Timer.bind().
+    '''
+    def __init__(self):
+        self.records = []
+        self.__lock = threading.Lock()
+
+    def record(self, record):
+        with self.__lock:
+            self.records.append(record)
+
+    def report(self):
+        '''
+        calls, total, mean and max seconds per phase.
+        '''
+        df = pd.DataFrame(self.records, columns=None if self.records else ['name', 'phase', 'seconds'])
+        return df.groupby('phase', sort=False)['seconds'].agg(calls='count', total='sum', mean='mean', max='max')
+
+
+class Timer:
+    '''
+    Wall time of named spans, nested spans are recorded with their phase, e.g. runsaver/Btest.run/I.
+    Spans cost nothing outside collect(), which is per thread, so concurrent runs keep their own records.
+    Each record is kept in the collection of its thread and passed to every callback.
+    '''
+    def __init__(self):
+        self.callbacks = []
+        self.profile = None
+        self.__local = threading.local()
+
+    def stack(self):
+        if not hasattr(self.__local, 'stack'): self.__local.stack = []
+        return self.__local.stack
+
+    def collection(self):
+        return getattr(self.__local, 'collection', None)
+
+    @property
+    def enabled(self):
+        return self.collection() is not None
+
+    def span(self, name, **info):
+        if self.collection() is None: return contextlib.nullcontext()
+        return Span(self, name, info)
+
+    def record(self, record):
+        self.collection().record(record)
+        for callback in self.callbacks:
+            callback(record)
+
+    def bind(self, func):
+        '''
+        func recording into the current thread's collection wherever it is called, e.g. in a writer thread.
+        '''
+        collection = self.collection()
+        if collection is None: return func
+        def bound(*args, **kwargs):
+            with self.collecting(collection):
+                return func(*args, **kwargs)
+        return bound
+
+    @contextlib.contextmanager
+    def collecting(self, collection):
+        previous, self.__local.collection = self.collection(), collection
+        try:
+            yield collection
+        finally:
+            self.__local.collection = previous
+
+    def add_callback(self, callback):
+        self.callbacks.append(callback)
+
+    def remove_callback(self, callback):
+        self.callbacks.remove(callback)
+
+    @contextlib.contextmanager
+    def profiling(self, path=None):
+        '''
+        cProfile the with block, the result is kept as self.profile (pstats.Stats) and dumped to path.
+        '''
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield self
+        finally:
+            profiler.disable()
+            self.profile = pstats.Stats(profiler)
+            if path: self.profile.dump_stats(path)
+
+    @contextlib.contextmanager
+    def collect(self, profile=False):
+        '''
+        Enable spans of this thread inside the with block, yields their Collection (records start empty).
+        profile=True (or a path to dump to) also runs profiling().
+        '''
+        with self.collecting(Collection()) as collection:
+            if profile:
+                with self.profiling(None if profile is True else profile):
+                    yield collection
+            else:
+                yield collection
+
+timer = Timer()
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+import inspect, sys, types
+import pandas as pd
+import numpy as np
+
+try:
+    from . import optimizer
+except:
+    import optimizer
+
+# Default size of Strategy.buy(), the fraction of available margin to invest
+FULL_EQUITY = 1 - sys.float_info.epsilon
+
+class Indicator(np.ndarray):
+    # Marks I() results, rows unpacked from a 2-D result stay Indicators
+    pass
+
+class Frame:
+    '''
+    Stand-in for a strategy instance, so that the strategy's own init() and signals()
+    run on whole candle arrays instead of inside backtesting's event loop.
+    '''
+    def __init__(self, strategy, candle, params):
+        self.strategy = strategy
+        self.candle = self.data = candle
+        self.indicator_params = params
+
+    def __getattr__(self, name):
+        value = getattr(self.strategy, name)
+        return types.MethodType(value, self) if inspect.isfunction(value) else value
+
+    def I(self, func, *args, **kwargs):
+        value = func(*args, **kwargs)
+        if isinstance(value, pd.DataFrame): value = value.values.T
+        return np.asarray(value, dtype=float).view(Indicator)
+
+    def warmup(self):
+        # Bars before every indicator kept on the strategy has a value, as backtesting's _indicator_warmup_nbars
+        return max((np.isnan(v).argmin(axis=-1).max() for v in vars(self).values() if isinstance(v, Indicator)), default=0)
+
+def signals(strategy, candle, params):
+    '''
+    Boolean entry/exit arrays of strategy.signals(), limited to the bars Btest calls next() on.
+    Entry wins over exit on the same bar, as in the if/elif of next().
+    '''
+    frame = Frame(strategy, candle, params)
+    with np.errstate(invalid='ignore'):
+        frame.init()
+        entry, exit = frame.signals()
+    entry, exit = np.array(entry, dtype=bool), np.array(exit, dtype=bool)
+    start = 1 + frame.warmup()
+    entry[:start], exit[:start] = False, False
+    return entry, exit & ~entry
+
+class Simulation:
+    '''
+    The broker of simulate(), fed one chunk of bars after another with feed(). Cash, open trades and
+    a signal on the last bar of a chunk carry over to the next chunk, bars in closed are counted from the first chunk.
+    '''
+    def __init__(self, cash=1000, commission=0.00495, margin=1.0, trade_on_close=True, exclusive_orders=True):
+        self.cash, self.commission, self.leverage = cash, commission, 1 / margin
+        self.trade_on_close, self.exclusive_orders = trade_on_close, exclusive_orders
+        self.trades, self.closed = [], []
+        self.offset = 0
+        # (open, close, entry, exit) of a signal on the last bar fed, processed with the next chunk
+        self.pending = None
+
+    def unrealized(self, price):
+        return price * sum(size for size, _, _ in self.trades) - sum(size * p for size, _, p in self.trades)
+
+    def feed(self, candle, entry, exit):
+        '''
+        Process the orders of one chunk of bars and return its equity.
+        '''
+        close, open = np.asarray(candle['Close'], dtype=float), np.asarray(candle['Open'], dtype=float)
+        entry, exit = np.asarray(entry, dtype=bool), np.asarray(exit, dtype=bool)
+        first = 0
+        if self.pending is not None:
+            # The signal bar of the previous chunk goes first, its equity is already out
+            o, c, e, x = self.pending
+            close, open, entry, exit = np.r_[c, close], np.r_[o, open], np.r_[e, entry], np.r_[x, exit]
+            first = 1
+        n, commission, leverage = len(close), self.commission, self.leverage
+        base = self.offset - first
+        equity = np.empty(n)
+        last = first
+        # Orders placed on the last bar wait for the next chunk
+        for i in np.flatnonzero(entry[:n-1] | exit[:n-1]):
+            j = i + 1
+            equity[last:j] = self.cash + self.unrealized(close[last:j])
+            last = j
+            price = close[i] if self.trade_on_close else open[j]
+            bar = base + (i if self.trade_on_close else j)
+            if exit[i] or self.exclusive_orders:
+                for size, entry_bar, entry_price in self.trades:
+                    self.cash += size * (price - entry_price) - size * price * commission
+                    self.closed.append((size, entry_bar, bar, entry_price, price))
+                self.trades = []
+            if entry[i]:
+                margin_available = max(0, self.cash + self.unrealized(close[j]) - sum(size * close[j] / leverage for size, _, _ in self.trades))
+                size = int((margin_available * leverage * FULL_EQUITY) // (price + (FULL_EQUITY * price * commission) / FULL_EQUITY))
+                if size:
+                    self.trades.append((size, bar, price))
+                    self.cash -= size * price * commission
+        equity[last:] = self.cash + self.unrealized(close[last:])
+        self.pending = (open[-1], close[-1], entry[-1], exit[-1]) if n > first and (entry[-1] or exit[-1]) else None
+        self.offset += n - first
+        return equity[first:]
+
+def simulate(candle, entry, exit, cash=1000, commission=0.00495, margin=1.0, trade_on_close=True, exclusive_orders=True):
+    '''
+    Fill all-in long market orders on entry and close the position on exit, with the arithmetic of
+    backtesting's broker: orders fill at the signal bar's close (trade_on_close) or the next bar's open,
+    commission is charged on entry and exit, exclusive_orders closes open trades before a new entry.
+    Only bars with a signal are visited, the equity curve is filled in per segment between them.
+    Returns the equity array and a list of (size, entry_bar, exit_bar, entry_price, exit_price).
+    '''
+    simulation = Simulation(cash, commission, margin, trade_on_close, exclusive_orders)
+    equity = simulation.feed(candle, entry, exit)
+    return equity, simulation.closed
+
+def run_chunks(strategy, chunks, params, **broker):
+    '''
+    Backtest strategy with signals() over (candle, n) chunks such as PartitionedDB.chunks(), one chunk in memory
+    at a time. The n rows carried over warm up the indicators, the broker state carries over in a Simulation.
+    Returns the equity Series and the closed trades as simulate().
+    '''
+    simulation = Simulation(**broker)
+    equity = []
+    for candle, n in chunks:
+        entry, exit = signals(strategy, candle, params)
+        equity.append(pd.Series(simulation.feed(candle.iloc[n:], entry[n:], exit[n:]), index=candle.index[n:]))
+    return pd.concat(equity), simulation.closed
+
+def headline(equity, closed, commission=0.00495):
+    # Headline stats from plain arrays, cheap enough to call for every combination of a grid
+    size, entry_bar, exit_bar, entry_price, exit_price = (np.array(v) for v in zip(*closed)) if closed else [np.array([], dtype=int)] * 5
+    pl = size * (exit_price - entry_price) - (size * exit_price * commission + size * entry_price * commission)
+    exposure = np.zeros(len(equity) + 1)
+    np.add.at(exposure, entry_bar, 1)
+    np.add.at(exposure, exit_bar + 1, -1)
+    return {
+        'Equity Final [$]':equity[-1],
+        'Equity Peak [$]':equity.max(),
+        'Return [%]':(equity[-1] - equity[0]) / equity[0] * 100,
+        'Max. Drawdown [%]':-np.nan_to_num((1 - equity / np.maximum.accumulate(equity)).max()) * 100,
+        '# Trades':len(closed),
+        'Win Rate [%]':(pl > 0).mean() * 100 if len(closed) else np.nan,
+        'Exposure Time [%]':(np.cumsum(exposure[:-1]) > 0).mean() * 100,
+        }
+
+def stats(candle, equity, closed, commission=0.00495):
+    index = candle.index
+    trades = pd.DataFrame(closed, columns=['Size', 'EntryBar', 'ExitBar', 'EntryPrice', 'ExitPrice']).astype(
+        {'Size':int, 'EntryBar':int, 'ExitBar':int, 'EntryPrice':float, 'ExitPrice':float})
+    commissions = trades['Size'] * trades['ExitPrice'] * commission + trades['Size'] * trades['EntryPrice'] * commission
+    trades['PnL'] = trades['Size'] * (trades['ExitPrice'] - trades['EntryPrice']) - commissions
+    trades['Commission'] = commissions
+    trades['ReturnPct'] = (trades['ExitPrice'] / trades['EntryPrice'] - 1) - commissions / (trades['Size'] * trades['EntryPrice'])
+    trades['EntryTime'] = index[trades['EntryBar'].values]
+    trades['ExitTime'] = index[trades['ExitBar'].values]
+    trades['Duration'] = trades['ExitTime'] - trades['EntryTime']
+    s = {'Start':index[0], 'End':index[-1], 'Duration':index[-1] - index[0]}
+    s.update(headline(equity, closed, commission))
+    s['_equity_curve'] = pd.DataFrame({'Equity':equity, 'DrawdownPct':1 - equity / np.maximum.accumulate(equity)}, index=index)
+    s['_trades'] = trades
+    return pd.Series(s, dtype=object)
+
+def run(strategy, candle, params, cash=1000, commission=0.00495, margin=1.0, trade_on_close=True, exclusive_orders=True):
+    '''
+    Vectorized counterpart of Btest(strategy).run() for strategies with signals(),
+    returning the headline stats, _equity_curve and _trades.
+    '''
+    entry, exit = signals(strategy, candle, params)
+    equity, closed = simulate(candle, entry, exit, cash, commission, margin, trade_on_close, exclusive_orders)
+    return stats(candle, equity, closed, commission)
+
+def screen(strategy, candle, params=None, metric=optimizer.METRIC, maximize=True, **broker):
+    '''
+    run() over the grid of params (default: strategy.base_indicator_params()), ranked by metric.
+    Confirm the top rows with optimizer.backtest() or Btest.
+    '''
+    combos = optimizer.grid(strategy.base_indicator_params() if params is None else params)
+    rows = []
+    for p in combos:
+        equity, closed = simulate(candle, *signals(strategy, candle, p), **broker)
+        rows.append(headline(equity, closed, broker.get('commission', 0.00495)))
+    return optimizer.rank(pd.concat([pd.DataFrame(combos), pd.DataFrame(rows)], axis=1), metric, maximize)
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+import os
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+import numpy as np
+
+try:
+    from . import indicator
+    from . import optimizer
+    from . import vectorized
+except:
+    import indicator
+    import optimizer
+    import vectorized
+
+def windows(bars, train, test, anchored=False):
+    '''
+    Folds over bars as (train_start, train_stop, test_start, test_stop) positions.
+    Test windows of test bars follow each other after the first train bars, each is trained on
+    the train bars before it (rolling) or on every bar before it (anchored).
+    '''
+    folds = []
+    for test_start in range(train, bars - 1, test):
+        folds.append((0 if anchored else test_start - train, test_start, test_start, min(test_start + test, bars)))
+    return folds
+
+def precompute(strategy, candle, combos):
+    '''
+    Compute the indicators of strategy.init() for every combination once on the whole candle, into indicator.cache.
+    Worker processes forked afterwards start with them.
+    '''
+    for params in combos:
+        try:
+            with np.errstate(all='ignore'):
+                vectorized.Frame(strategy, candle, params).init()
+        except Exception:
+            # Only a warm-up, strategies whose init() needs backtesting's Strategy compute in the folds
+            pass
+
+# State of a pool worker, filled once by _init_worker
+_worker = {}
+
+def _init_worker(strategy, candle, combos, metric, maximize, broker):
+    _worker.update(strategy=strategy, candle=candle, combos=combos, metric=metric, maximize=maximize, broker=broker)
+
+def _fold(fold):
+    strategy, candle, combos, broker = _worker['strategy'], _worker['candle'], _worker['combos'], _worker['broker']
+    train_start, train_stop, test_start, test_stop = fold
+    with indicator.cache.sliced(candle):
+        train = candle.iloc[train_start:train_stop]
+        rows = [optimizer.stats(optimizer.backtest(strategy, train, params, **broker)) for params in combos]
+        ranked = optimizer.rank(pd.DataFrame(rows).assign(combo=range(len(combos))), _worker['metric'], _worker['maximize'])
+        best = combos[ranked['combo'].iloc[0]]
+        result = optimizer.backtest(strategy, candle.iloc[test_start:test_stop], best, **broker)
+    index = candle.index
+    row = {
+        'Train Start':index[train_start],
+        'Train End':index[train_stop-1],
+        'Test Start':index[test_start],
+        'Test End':index[test_stop-1],
+        'Params':best,
+        'In-Sample':ranked[_worker['metric']].iloc[0],
+        'Out-of-Sample':result[_worker['metric']],
+        '# Trades':result['# Trades'],
+        }
+    return row, result['_equity_curve']['Equity'], result['_trades']
+
+def stitch(equities):
+    '''
+    One equity curve of consecutive test windows, each window starts with the equity the previous one ended with.
+    '''
+    parts, capital = [], None
+    for equity in equities:
+        part = equity if capital is None else equity / equity.iloc[0] * capital
+        capital = part.iloc[-1]
+        parts.append(part)
+    equity = pd.concat(parts)
+    return pd.DataFrame({'Equity':equity, 'DrawdownPct':1 - equity / equity.cummax()})
+
+def summarize(curve, folds, trades):
+    equity = curve['Equity']
+    s = {
+        'Start':curve.index[0],
+        'End':curve.index[-1],
+        'Duration':curve.index[-1] - curve.index[0],
+        'Equity Final [$]':equity.iloc[-1],
+        'Equity Peak [$]':equity.max(),
+        'Return [%]':(equity.iloc[-1] - equity.iloc[0]) / equity.iloc[0] * 100,
+        'Max. Drawdown [%]':-curve['DrawdownPct'].max() * 100,
+        '# Trades':len(trades),
+        'Win Rate [%]':(trades['PnL'] > 0).mean() * 100 if len(trades) else np.nan,
+        '# Folds':len(folds),
+        }
+    s['_equity_curve'] = curve
+    s['_folds'] = folds
+    s['_trades'] = trades
+    return pd.Series(s, dtype=object)
+
+def walk_forward(strategy, candle, train, test, params=None, anchored=False, metric=optimizer.METRIC, maximize=True, processes=None, **broker):
+    '''
+    Walk-forward optimization of strategy on candle (e.g. LocalDB.loader()): for each fold of windows(),
+    pick the best of params (default: strategy.base_indicator_params()) by metric on the train window
+    and backtest it on the test window. train and test are numbers of bars.
+    Indicators are computed once on the whole candle and cut to each window (indicator.cache.sliced),
+    folds run in parallel, processes=1 runs in the current process.
+    Returns the stats of the stitched out-of-sample equity curve with _equity_curve, _folds and _trades.
+    '''
+    combos = optimizer.grid(strategy.base_indicator_params() if params is None else params)
+    folds = windows(len(candle), train, test, anchored)
+    if not folds: raise ValueError('candle of %d bars is too short for train=%d' % (len(candle), train))
+    if processes is None: processes = os.cpu_count() or 1
+    processes = min(processes, len(folds))
+    precompute(strategy, candle, combos)
+    args = (strategy, candle, combos, metric, maximize, broker)
+    if processes <= 1:
+        _init_worker(*args)
+        results = [_fold(fold) for fold in folds]
+    else:
+        with ProcessPoolExecutor(max_workers=processes, initializer=_init_worker, initargs=args) as pool:
+            results = list(pool.map(_fold, folds))
+    df_folds = pd.DataFrame([row for row, _, _ in results])
+    curve = stitch([equity for _, equity, _ in results])
+    trades = pd.concat([t.assign(Fold=i) for i, (_, _, t) in enumerate(results)], ignore_index=True)
+    return summarize(curve, df_folds, trades)
@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+import importlib, json, multiprocessing, os, socket, sqlite3, time, traceback
+import pandas as pd
+
+try:
+    from . import db
+    from . import optimizer
+    from .store import dumps, pack, unpack
+except:
+    import db
+    import optimizer
+    from store import dumps, pack, unpack
+
+def strategy_name(strategy):
+    return strategy.__module__ + ':' + strategy.__qualname__
+
+def get_strategy(name):
+    module, qualname = name.split(':')
+    return getattr(importlib.import_module(module), qualname)
+
+def worker_id():
+    return '%s:%d' % (socket.gethostname(), os.getpid())
+
+
+class WorkQueue:
+    '''
+    Durable queue of backtests (issue, strategy, params, period, broker) in one SQLite file, e.g. on a file system
+    shared by several hosts. A coordinator submit()s grids, any number of workers (see work) lease tasks,
+    backtest them and write the stats back into the task, collect() moves them into a store.ResultStore.
+    A lease not completed within its timeout (a dead worker) is handed out again, up to max_attempts times.
+    The file keeps SQLite's rollback journal, WAL does not work across hosts.
+    '''
+    def __init__(self, path, max_attempts=3, timeout=60):
+        self.path = path
+        self.max_attempts = max_attempts
+        # Autocommit, leases take the write lock with BEGIN IMMEDIATE
+        self.con = sqlite3.connect(path, timeout=timeout, isolation_level=None)
+        self.con.execute('''CREATE TABLE IF NOT EXISTS tasks (
+            id INTEGER PRIMARY KEY, issue TEXT, strategy TEXT, params TEXT, start TEXT, end TEXT, broker TEXT,
+            status TEXT DEFAULT 'pending', worker TEXT, leased_until REAL, attempts INTEGER DEFAULT 0, error TEXT,
+            first TEXT, last TEXT, result BLOB, collected INTEGER DEFAULT 0,
+            UNIQUE (issue, strategy, params, start, end, broker))''')
+        self.con.execute('CREATE INDEX IF NOT EXISTS tasks_status ON tasks (status, leased_until)')
+
+    def close(self):
+        self.con.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def submit(self, issues, strategies, start, end, params=None, broker=None):
+        '''
+        Queue every combination of params (default: each strategy's base_indicator_params(),
+        or {strategy: params}) of strategies on issues for start .. end. Tasks already queued are kept.
+        Returns the number of tasks added.
+        '''
+        grids = params if params and all(isinstance(k, type) for k in params) else dict.fromkeys(strategies, params)
+        rows = []
+        for issue in issues:
+            for strategy in strategies:
+                grid = grids.get(strategy)
+                for combo in optimizer.grid(grid or strategy.base_indicator_params()):
+                    rows.append((issue, strategy_name(strategy), dumps(combo), str(start), str(end), dumps(broker or {})))
+        before = self.con.total_changes
+        self.con.execute('BEGIN IMMEDIATE')
+        self.con.executemany('INSERT OR IGNORE INTO tasks (issue, strategy, params, start, end, broker) VALUES (?, ?, ?, ?, ?, ?)', rows)
+        self.con.execute('COMMIT')
+        return self.con.total_changes - before
+
+    def lease(self, worker, n=1, lease=600):
+        '''
+        Up to n pending tasks (or tasks whose lease expired) for worker, each held for lease seconds,
+        as dicts of the task columns with params and broker decoded.
+        '''
+        now = time.time()
+        self.con.execute('BEGIN IMMEDIATE')
+        try:
+            self.con.execute("UPDATE tasks SET status='failed', error='lease expired' WHERE status='leased' AND leased_until < ? AND attempts >= ?",
+                (now, self.max_attempts))
+            rows = self.con.execute('''SELECT id, issue, strategy, params, start, end, broker FROM tasks
+                WHERE (status='pending' OR (status='leased' AND leased_until < ?)) AND attempts < ? ORDER BY id LIMIT ?''',
+                (now, self.max_attempts, n)).fetchall()
+            self.con.executemany("UPDATE tasks SET status='leased', worker=?, leased_until=?, attempts=attempts+1 WHERE id=?",
+                [(worker, now + lease, row[0]) for row in rows])
+            self.con.execute('COMMIT')
+        except BaseException:
+            self.con.execute('ROLLBACK')
+            raise
+        keys = ('id', 'issue', 'strategy', 'params', 'start', 'end', 'broker')
+        tasks = [dict(zip(keys, row)) for row in rows]
+        for task in tasks:
+            task['params'], task['broker'] = json.loads(task['params']), json.loads(task['broker'])
+        return tasks
+
+    def renew(self, ids, worker, lease=600):
+        # Extend the leases worker still holds
+        self.con.executemany("UPDATE tasks SET leased_until=? WHERE id=? AND status='leased' AND worker=?",
+            [(time.time() + lease, i, worker) for i in ids])
+
+    def complete(self, task, worker, result, first, last):
+        '''
+        Store the stats of a task worker still holds, first and last are the bars of the backtested candle.
+        Returns False when its lease expired and the task was handed to another worker meanwhile.
+        '''
+        cursor = self.con.execute("UPDATE tasks SET status='done', result=?, first=?, last=?, error=NULL WHERE id=? AND status='leased' AND worker=?",
+            (pack(result), str(first), str(last), task, worker))
+        return cursor.rowcount > 0
+
+    def fail(self, task, worker, error):
+        # Back to pending until max_attempts, if worker still holds it
+        self.con.execute("UPDATE tasks SET status=CASE WHEN attempts < ? THEN 'pending' ELSE 'failed' END, error=? WHERE id=? AND status='leased' AND worker=?",
+            (self.max_attempts, error, task, worker))
+
+    def status(self):
+        '''
+        Number of tasks by status, leases past their timeout count as expired.
+        '''
+        counts = dict.fromkeys(('pending', 'leased', 'expired', 'done', 'failed'), 0)
+        rows = self.con.execute('''SELECT CASE WHEN status='leased' AND leased_until < ? THEN 'expired' ELSE status END, COUNT(*)
+            FROM tasks GROUP BY 1''', (time.time(),)).fetchall()
+        counts.update(rows)
+        return counts
+
+    def unfinished(self):
+        # Tasks pending or leased, lease() fails expired leases out of attempts
+        return self.con.execute("SELECT COUNT(*) FROM tasks WHERE status IN ('pending', 'leased')").fetchone()[0]
+
+    def results(self, strategy=None, issue=None):
+        '''
+        DataFrame of issue, strategy, params and stats of the done tasks of strategy (a class or its name) and issue.
+        '''
+        sql, args = "SELECT issue, strategy, params, result FROM tasks WHERE status='done'", []
+        if strategy is not None:
+            sql += ' AND strategy LIKE ?'
+            args.append(strategy_name(strategy) if isinstance(strategy, type) else '%:' + strategy)
+        if issue is not None:
+            sql += ' AND issue=?'
+            args.append(issue)
+        rows = [dict(issue=i, strategy=s, **json.loads(p), **unpack(r)) for i, s, p, r in self.con.execute(sql, args)]
+        return pd.DataFrame(rows)
+
+    def collect(self, store):
+        '''
+        Put the done tasks not collected yet into store (a store.ResultStore) as optimizer.optimize(store=...) does,
+        keyed by the first and last bar of the candle and aggregated by the task's start .. end. Returns the number of runs stored.
+        '''
+        rows = self.con.execute("SELECT id, issue, strategy, params, broker, start, end, first, last, result FROM tasks WHERE status='done' AND collected=0").fetchall()
+        for task, issue, strategy, params, broker, start, end, first, last, result in rows:
+            store.put(unpack(result), issue, first, last, strategy.split(':')[1], json.loads(params), json.loads(broker), (start, end))
+            self.con.execute('UPDATE tasks SET collected=1 WHERE id=?', (task,))
+        return len(rows)
+
+
+def _work(path, localdb, batch, lease, poll, kwargs):
+    # One worker process: lease, backtest and complete tasks until none is left
+    worker, candles, strategies = worker_id(), {}, {}
+    local = db.LocalDB(localdb, **kwargs) if localdb else db.LocalDB(**kwargs)
+    with WorkQueue(path) as queue:
+        while True:
+            tasks = queue.lease(worker, batch, lease)
+            if not tasks:
+                if not queue.unfinished(): return
+                # Others hold the rest, wait for them or for their leases to expire
+                time.sleep(poll)
+                continue
+            for n, task in enumerate(tasks):
+                # The lease of the rest of the batch runs from now, so lease only has to cover one backtest
+                if n: queue.renew([t['id'] for t in tasks[n:]], worker, lease)
+                try:
+                    key = (task['issue'], task['start'], task['end'])
+                    if key not in candles:
+                        # Tasks are leased in submission order, so the candles of one issue come together
+                        candles.clear()
+                        candles[key] = local.loader(*key)
+                    if task['strategy'] not in strategies: strategies[task['strategy']] = get_strategy(task['strategy'])
+                    candle = candles[key]
+                    result = optimizer.backtest(strategies[task['strategy']], candle, task['params'], **task['broker'])
+                    queue.complete(task['id'], worker, optimizer.stats(result), candle.index[0], candle.index[-1])
+                except Exception:
+                    queue.fail(task['id'], worker, traceback.format_exc())
+
+def work(path, localdb=None, processes=1, batch=8, lease=600, poll=5, **kwargs):
+    '''
+    Run processes workers on this host for the WorkQueue at path until every task is done or failed.
+    Candles are loaded by a LocalDB at localdb (e.g. on the shared file system) with kwargs (save_format, source),
+    load them once before (e.g. on the coordinator) so that workers do not fetch and write the same candle at once.
+    Each worker leases batch tasks at a time for lease seconds, renewed before each of them, lease must cover one backtest.
+    '''
+    args = (path, localdb, batch, lease, poll, kwargs)
+    if processes <= 1:
+        _work(*args)
+        return
+    workers = [multiprocessing.Process(target=_work, args=args) for _ in range(processes)]
+    for p in workers: p.start()
+    for p in workers: p.join()
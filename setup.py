@@ -13,5 +13,6 @@ setup(
     install_requires=install_requirements,
     url='https://github.com/ottomossei/bwb/',
     license=license,
-    packages=find_packages(exclude=['examples'])
+    packages=find_packages(exclude=['examples']),
+    entry_points={'console_scripts':['bwb=bwb.cli:main']},
 )
\ No newline at end of file
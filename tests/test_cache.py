@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+import importlib, sys
+
+from bwb import basicstrategy as bst, cache, db, optimizer
+from test_stream import candle
+
+def test_code_digest_follows_reloaded_module(tmp_path, monkeypatch):
+    monkeypatch.syspath_prepend(str(tmp_path))
+    path = tmp_path / 'digested.py'
+    path.write_text('X = 1\n')
+    import digested
+    try:
+        before = cache.code_digest(digested)
+        path.write_text('X = 22\n')
+        importlib.reload(digested)
+        assert cache.code_digest(digested) != before
+    finally:
+        sys.modules.pop('digested', None)
+
+def test_bound_strategies_do_not_grow_the_digest_cache():
+    df = candle().dropna()
+    cache.strategy_digest(optimizer.bind(bst.SMACross, df, {'n1':5, 'n2':25}))
+    entries = cache.class_digest.cache_info().currsize
+    digests = {cache.strategy_digest(optimizer.bind(bst.SMACross, df, {'n1':n, 'n2':25})) for n in range(50)}
+    assert len(digests) == 50
+    assert cache.class_digest.cache_info().currsize == entries
+
+def test_localdb_result_cache_is_scoped(tmp_path):
+    local = db.LocalDB(path_localdb=str(tmp_path) + '/', result_cache=True)
+    assert not bst.result_cache.active()
+    with local.results():
+        assert bst.result_cache.active()
+        assert bst.result_cache.disk_dir() == str(tmp_path) + '/results/'
+    assert not bst.result_cache.active()
@@ -0,0 +1,17 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+
+from bwb import indicator
+from test_stream import candle
+
+@pytest.mark.parametrize('seed', [0, 1])
+def test_sar_sets_equal_per_set_loop(seed):
+    df = candle(seed=seed)
+    iaf = np.array([0.01, 0.02, 0.02, 0.05, 0.3])
+    maxaf = np.array([0.1, 0.2, 0.5, 0.05, 0.2])
+    high, low, close = list(df['High']), list(df['Low']), list(df['Close'])
+    results = [indicator._sar_list(high, low, close, a, m) for a, m in zip(iaf.tolist(), maxaf.tolist())]
+    expected = tuple(np.array(v, dtype=float) for v in zip(*results))
+    for got, want in zip(indicator.sar(df, iaf, maxaf), expected):
+        np.testing.assert_array_equal(got, want)
@@ -0,0 +1,17 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from bwb import basicstrategy as bst, portfolio
+from test_stream import candle
+
+def test_partial_weights_skip_zero_weight_issues():
+    candles = {issue:candle(seed=seed).dropna() for seed, issue in enumerate('ABC')}
+    result = portfolio.run(bst.SMACross, candles, {'n1':5, 'n2':25}, cash=1000, weights={'A':3, 'B':1}, processes=1)
+    assert list(result['_issues'].index) == ['A', 'B']
+    assert list(result['_equity_curve'].columns[:2]) == ['A', 'B']
+    assert result['_equity_curve']['Equity'].iloc[0] == pytest.approx(1000)
+
+@pytest.mark.parametrize('weights', [{'D':1}, {'A':0}, {'A':2, 'B':-1}])
+def test_allocate_rejects_weights_without_cash(weights):
+    with pytest.raises(ValueError):
+        portfolio.allocate(['A', 'B'], 1000, weights)
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+import datetime
+import pandas as pd
+
+from bwb import store
+
+def result(sharpe):
+    return pd.Series({'Start':pd.Timestamp('2020-01-02'), 'End':pd.Timestamp('2020-12-30'), 'Sharpe Ratio':sharpe}, dtype=object)
+
+def test_top_groups_issues_by_requested_period(tmp_path):
+    with store.ResultStore(str(tmp_path / 'runs.db')) as s:
+        # Different calendars, the same job
+        s.put(result(1.0), 'A', '2020-01-02', '2020-12-30', 'S', {'n':1}, period=('2020-01-01', '2020-12-31'))
+        s.put(result(3.0), 'B', '2020-01-03', '2020-12-29', 'S', {'n':1}, period=(datetime.date(2020, 1, 1), pd.Timestamp('2020-12-31')))
+        s.put(result(5.0), 'A', '2021-01-04', '2021-12-30', 'S', {'n':1}, period=('2021-01-01', '2021-12-31'))
+        df = s.top('S')
+    assert list(df['issues']) == [1, 2]
+    assert list(df['sharpe_ratio']) == [5.0, 2.0]
+    assert df['period'].iloc[1] == '2020-01-01T00:00:00/2020-12-31T00:00:00'
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pandas as pd
+import pytest
+
+from bwb import indicator, stream
+
+def candle(bars=300, seed=0):
+    # Random walk with flat runs (equal closes, high == low) and NaN bars
+    rng = np.random.default_rng(seed)
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.01, bars)))
+    close[50:70] = close[50]
+    close[150:153] = np.nan
+    high = close * (1 + rng.random(bars) * 0.01)
+    low = close * (1 - rng.random(bars) * 0.01)
+    high[50:70] = low[50:70] = close[50:70]
+    high[200], low[201] = np.nan, np.nan
+    index = pd.date_range('2000-01-01', periods=bars, freq='D')
+    return pd.DataFrame({'Open':close, 'High':high, 'Low':low, 'Close':close, 'Volume':1.0}, index=index)
+
+CASES = [
+    ('SMAStream', lambda: stream.SMAStream(5), lambda df: indicator.sma(df, 5)),
+    ('SigmaStream', lambda: stream.SigmaStream(5), lambda df: indicator.sigma(df, 5)),
+    ('EMAStream', lambda: stream.EMAStream(5), lambda df: indicator.ema(df, 5)),
+    ('MACDStream', lambda: stream.MACDStream(), lambda df: indicator.macd(df)),
+    ('CIStream', lambda: stream.CIStream(20), lambda df: indicator.ci(df, 20)),
+    ('TRStream', lambda: stream.TRStream(), lambda df: indicator.tr(df)),
+    ('DIStream', lambda: stream.DIStream(14), lambda df: indicator.di(df, 14)),
+    ('ADXStream', lambda: stream.ADXStream(14), lambda df: indicator.adx(df, 14)),
+    ('SARStream', lambda: stream.SARStream(), lambda df: indicator.sar(df)),
+    ('RSIStream', lambda: stream.RSIStream(14), lambda df: indicator.rsi(df, 14)),
+    ('StochStream', lambda: stream.StochStream(), lambda df: indicator.slow_s(df)),
+    ('FastStochStream', lambda: stream.StochStream(slow=False), lambda df: indicator.fast_s(df)),
+    ('PsycoStream', lambda: stream.PsycoStream(12), lambda df: indicator.psyco(df, 12)),
+    ('RCIStream', lambda: stream.RCIStream(9), lambda df: indicator.rci(df, 9)),
+    ('MAERStream', lambda: stream.MAERStream(25), lambda df: indicator.maer(df, 25)),
+    ]
+
+@pytest.mark.parametrize('make, batch', [case[1:] for case in CASES], ids=[case[0] for case in CASES])
+def test_stream_equals_batch(make, batch):
+    # Fresh stream per test, instances carry state between updates
+    df = candle()
+    expected = batch(df)
+    expected = np.array([np.asarray(v, dtype=float) for v in expected] if isinstance(expected, tuple) else np.asarray(expected, dtype=float))
+    np.testing.assert_array_equal(stream.replay(make(), df), expected)
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from bwb.timing import Timer
+
+def test_collect_keeps_records_per_thread_and_bound_calls():
+    timer = Timer()
+    ready, runs = threading.Barrier(2), {}
+
+    def write(name):
+        with timer.span(name):
+            pass
+
+    def run(name):
+        with timer.collect() as collection:
+            ready.wait()
+            write(name)
+            with ThreadPoolExecutor(max_workers=1) as pool:
+                pool.submit(timer.bind(write), 'write').result()
+                pool.submit(write, 'unbound').result()
+            ready.wait()
+        runs[name] = [record['phase'] for record in collection.records]
+
+    threads = [threading.Thread(target=run, args=(name,)) for name in ('a', 'b')]
+    for thread in threads: thread.start()
+    for thread in threads: thread.join()
+    assert runs == {'a':['a', 'write'], 'b':['b', 'write']}
+    assert not timer.enabled